@@ -23,5 +23,4 @@ __copyright__ = '(c) 2010 %s' % __author__
 __license__ = 'GPL-2'
 __version__ = '0.2.1'
 
-import base
-import models
+from pidsim.models import base, models
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.aio
+    ~~~~~~~~~~~~~~~~~
+
+    asyncio interface of :class:`pidsim.models.streaming.Stream`. Requires
+    Python 3.6 or newer, and NumPy.
+
+    Usage::
+
+        async for y in aio.run(stream, inputs):
+            await actuator.write(y)
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['run']
+
+import asyncio
+
+
+async def run(stream, inputs, executor=False):
+    """Asynchronous generator that feeds every item of ``inputs`` (an
+    asynchronous or a plain iterable of scalars or 1-D arrays of samples)
+    to ``stream``, and yields its outputs.
+
+    The simulation of each item runs in the event loop thread, yielding
+    control between items when ``inputs`` is a plain iterable. For large
+    chunks, pass an ``executor`` (or ``None``, for the default one of the
+    loop) to run it with ``loop.run_in_executor`` instead.
+    """
+    loop = asyncio.get_event_loop()
+
+    async def feed(u):
+        if executor is False:
+            return stream.feed(u)
+        return await loop.run_in_executor(executor, stream.feed, u)
+
+    if hasattr(inputs, '__aiter__'):
+        async for u in inputs:
+            yield await feed(u)
+    else:
+        for u in inputs:
+            yield await feed(u)
+            await asyncio.sleep(0)
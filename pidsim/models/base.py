@@ -9,9 +9,138 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
-__all__ = ['ReferenceModel', 'I18nStr']
+__all__ = ['ReferenceModel', 'I18nStr', 'Parameter', 'Signature', 'Metrics']
 
 import inspect
+import threading
+from collections import namedtuple
+from timeit import default_timer
+
+from pidsim.models import instrumentation
+from pidsim.models.cache import StripedLRUCache
+
+_missing = object()
+
+# guards the lazy creation of the per-class signatures, caches and shared
+# instances
+_class_lock = threading.RLock()
+
+# tf and poly stand for the pidsim.core.types classes, that are only
+# imported on first use: calling them builds real instances, and isinstance
+# checks are passed through.
+
+class _LazyType(type):
+    
+    def _resolve(cls):
+        target = cls.__dict__.get('_target')
+        if target is None:
+            from pidsim.core import types
+            target = getattr(types, cls.__name__)
+            cls._target = target
+        return target
+    
+    def __call__(cls, *args, **kwargs):
+        return (cls.__dict__.get('_target') or cls._resolve())(*args,
+                                                                **kwargs)
+    
+    def __instancecheck__(cls, instance):
+        return isinstance(instance, cls._resolve())
+    
+    def __subclasscheck__(cls, subclass):
+        return issubclass(subclass, cls._resolve())
+
+
+tf = _LazyType('tf', (object,), {})
+poly = _LazyType('poly', (object,), {})
+
+
+# inspect.getargspec is gone from recent Python versions
+_getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
+_Parameter = namedtuple('Parameter', 'name type minimum maximum default '
+                        'suggested exclusive choices')
+
+
+class Parameter(_Parameter):
+    """Metadata of a callback argument.
+
+    ``type`` is ``float`` or ``int`` (integral values only). ``minimum``
+    and ``maximum`` are the bounds (``None`` means unbounded), exclusive if
+    ``exclusive`` is set. ``choices`` is a sequence of the only accepted
+    values, or a function returning it. ``suggested`` are the values
+    suggested in the model description. Models declare them without
+    ``name`` and ``default``, that are filled in from the callback
+    signature.
+    """
+    
+    __slots__ = ()
+    
+    def __new__(cls, type=float, minimum=None, maximum=None, suggested=(),
+                exclusive=False, choices=None, name=None, default=None):
+        return _Parameter.__new__(cls, name, type, minimum, maximum, default,
+                                  tuple(suggested), exclusive, choices)
+    
+    def invalid(self, values):
+        """Returns a boolean mask of the invalid entries of the NumPy array
+        ``values``."""
+        import numpy
+        invalid = ~numpy.isfinite(values)
+        if self.type is int:
+            invalid |= values != numpy.floor(values)
+        if self.minimum is not None:
+            if self.exclusive:
+                invalid |= values <= self.minimum
+            else:
+                invalid |= values < self.minimum
+        if self.maximum is not None:
+            if self.exclusive:
+                invalid |= values >= self.maximum
+            else:
+                invalid |= values > self.maximum
+        choices = self.choices
+        if callable(choices):
+            choices = choices()
+        if choices is not None:
+            invalid |= ~numpy.isin(values, list(choices))
+        return invalid
+
+
+Metrics = namedtuple('Metrics', 'poles zeros gain dc_gain time_constant '
+                     'stable integrating unstable minimum_phase')
+
+
+class Signature(object):
+    """Immutable description of the callback arguments of a model class."""
+    
+    def __init__(self, model_class):
+        argspec = _getargspec(model_class.callback)
+        args = tuple(argspec.args[1:])
+        defaults = argspec.defaults or ()
+        defaults = dict(zip(args[len(args) - len(defaults):], defaults))
+        declared = model_class.parameters
+        unknown = set(declared) - set(args)
+        if unknown:
+            raise TypeError('%s declares unknown parameter(s): %s' % \
+                (model_class.__name__, ', '.join(sorted(unknown))))
+        self.args = args
+        self.defaults = defaults
+        self.parameters = tuple(
+            declared.get(arg, Parameter())._replace(name=arg,
+                                                    default=defaults.get(arg))
+            for arg in args)
+        self.integer_args = tuple(parameter.name for parameter in \
+            self.parameters if parameter.type is int)
+
+
+class _SignatureAttribute(object):
+    # exposes an attribute of the class signature on classes and instances
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __get__(self, instance, owner):
+        return getattr(owner.signature(), self.name)
+
 
 class ReferenceModel(object):
     
@@ -19,30 +148,733 @@ class ReferenceModel(object):
     description = None
     transfer_function = None
     
-    def __init__(self, locale):
+    # maximum number of transfer functions memoized by callback, per model
+    # class. Set it to 0 on a subclass whose callback is cheaper to build
+    # than to look up.
+    callback_cache_size = 128
+    
+    # maximum number of entries of each of the other model caches
+    # (state_space, zoh, discretize, reduce and metrics), per model class.
+    # Changing either size at runtime replaces the caches, dropping their
+    # entries.
+    cache_size = 128
+    
+    # the caches are split in this many independently locked parts, so
+    # threads sharing a model rarely wait for each other.
+    cache_stripes = 8
+    
+    # metadata of the callback arguments, as a dict of Parameter objects.
+    # Arguments not declared here are unbounded floats.
+    parameters = {}
+    
+    # computed once per class from the callback signature. integer_args
+    # are the arguments that change the degree of the transfer function,
+    # and so are truncated to integers.
+    args = _SignatureAttribute('args')
+    integer_args = _SignatureAttribute('integer_args')
+    
+    def __init__(self, locale=None):
+        # the instances are never changed after this, so they can be shared
+        # between threads. locale is only the default of ``get``.
         self._locale = locale
-        self._parse_callback_parameters()
+        self._uncached_callback = self.callback
+        self.callback = self._dispatch_callback
+    
+    @classmethod
+    def signature(cls):
+        """Returns the :class:`Signature` of the model class."""
+        signature = cls.__dict__.get('_signature')
+        if signature is None:
+            with _class_lock:
+                signature = cls.__dict__.get('_signature')
+                if signature is None:
+                    signature = Signature(cls)
+                    cls._signature = signature
+        return signature
+    
+    @classmethod
+    def for_locale(cls, locale):
+        """Returns a shared instance of the model class for ``locale``. It
+        is safe to use from any thread."""
+        instances = cls.__dict__.get('_instances')
+        instance = instances.get(locale) if instances is not None else None
+        if instance is None:
+            with _class_lock:
+                instances = cls.__dict__.get('_instances')
+                if instances is None:
+                    instances = {}
+                    cls._instances = instances
+                instance = instances.get(locale)
+                if instance is None:
+                    instance = cls(locale)
+                    instances[locale] = instance
+        return instance
     
     def callback(self):
         raise NotImplementedError('You should overwrite this method.')
+    
+    def coefficients(self):
+        """Returns the numerator and denominator coefficients of the
+        transfer function built by ``callback``, as plain lists.
+        """
+        raise NotImplementedError('You should overwrite this method.')
+    
+    def zpk(self):
+        """Returns the zeros, poles and gain of the transfer function built
+        by ``callback``, so that ``G(s) = gain * prod(s - zeros) /
+        prod(s - poles)``. They are taken from the factored form the model
+        is defined with, instead of from the roots of the expanded
+        polynomials.
 
-    def _parse_callback_parameters(self):
-        argspec = inspect.getargspec(self.callback)
-        self.args = argspec.args[1:]
+        Like ``coefficients``, it is also called by ``metrics_batch`` with
+        arrays for the arguments that are not integer, and must then
+        return arrays, with NaN for the roots that some of the parameter
+        sets don't have.
+        """
+        raise NotImplementedError('You should overwrite this method.')
+    
+    def metrics(self, *args, **kwargs):
+        """Returns the :class:`Metrics` of the model, derived from ``zpk``
+        without any root finding:
+
+        - ``poles``, ``zeros`` and ``gain``, as returned by ``zpk``;
+        - ``dc_gain``, ``G(0)`` (``inf`` with poles at the origin);
+        - ``time_constant``, of the slowest pole in the left half-plane
+          (None if there is none);
+        - ``stable``, all the poles in the left half-plane;
+        - ``integrating``, poles at the origin, the others stable;
+        - ``unstable``, poles in the right half-plane, or repeated on the
+          imaginary axis;
+        - ``minimum_phase``, no zeros in the right half-plane and no dead
+          time.
+
+        The results are cached per parameters.
+        """
+        return self._memoize('metrics', self._cache_key(args, kwargs),
+                             lambda: self._metrics(args, kwargs))
+    
+    def _metrics(self, args, kwargs):
+        zeros, poles, gain = self.zpk(*args, **kwargs)
+        poles = tuple(complex(pole) for pole in poles)
+        zeros = tuple(complex(zero) for zero in zeros)
+        scale = max([abs(root) for root in poles + zeros] + [1.0])
+        tolerance = 1e-12 * scale
+        origin = [pole for pole in poles if abs(pole) <= tolerance]
+        axis = [pole for pole in poles if abs(pole.real) <= tolerance]
+        left = [pole for pole in poles if pole.real < -tolerance]
+        right = [pole for pole in poles if pole.real > tolerance]
+        repeated = any(abs(a - b) <= tolerance \
+                       for i, a in enumerate(axis) for b in axis[i + 1:])
+        if origin:
+            dc_gain = float('inf')
+        else:
+            dc_gain = complex(gain)
+            for zero in zeros:
+                dc_gain *= -zero
+            for pole in poles:
+                dc_gain /= -pole
+            dc_gain = dc_gain.real
+        time_constant = None
+        if left:
+            time_constant = -1.0 / max(pole.real for pole in left)
+        return Metrics(
+            poles=poles,
+            zeros=zeros,
+            gain=float(gain),
+            dc_gain=dc_gain,
+            time_constant=time_constant,
+            stable=not axis and not right,
+            integrating=bool(origin) and len(axis) == len(origin) and \
+                not right and not repeated,
+            unstable=bool(right) or repeated,
+            minimum_phase=not any(zero.real > tolerance for zero in zeros) \
+                and not self.dead_time(*args, **kwargs))
+    
+    def metrics_batch(self, **arrays):
+        """Returns the scalar :class:`Metrics` fields (``dc_gain``,
+        ``time_constant``, ``stable``, ``integrating``, ``unstable`` and
+        ``minimum_phase``) for many parameter sets at once, as a dict of
+        arrays, with one entry per parameter set. The parameters are
+        given as in ``callback_batch``, and validated the same way. A
+        missing time constant is NaN. The metrics are computed from
+        ``zpk`` evaluated over the whole arrays, and not cached. Requires
+        NumPy.
+        """
+        import numpy
+        self._check_batch(arrays)
+        columns, size = self._columns(arrays)
+        names = ('dc_gain', 'time_constant', 'stable', 'integrating',
+                 'unstable', 'minimum_phase')
+        results = dict((name, numpy.empty(size, dtype=float if i < 2 \
+                        else bool)) for i, name in enumerate(names))
+        for mask, params in self._groups(columns, size):
+            rows = int(mask.sum())
+            zeros, poles, gain = self.zpk(*params)
+            metrics = _metrics_arrays(_root_array(zeros, rows),
+                                      _root_array(poles, rows),
+                                      numpy.broadcast_to(gain, (rows,)),
+                                      numpy.broadcast_to(
+                                          self.dead_time(*params), (rows,)))
+            for name, values in zip(names, metrics):
+                results[name][mask] = values
+        return results
     
-    def get(self, key):
+    def _columns(self, arrays):
+        # checks the keyword arrays against args, and broadcasts them
+        import numpy
+        unknown = set(arrays) - set(self.args)
+        if unknown:
+            raise TypeError('Unknown argument(s): %s' % \
+                ', '.join(sorted(unknown)))
+        missing = [arg for arg in self.args if arg not in arrays]
+        if missing:
+            raise TypeError('Missing argument(s): %s' % ', '.join(missing))
+        columns = [numpy.asarray(arrays[arg], dtype=float).ravel() \
+            for arg in self.args]
+        if columns:
+            columns = numpy.broadcast_arrays(*columns)
+            return columns, len(columns[0])
+        return columns, 1
+    
+    def validate(self, **arrays):
+        """Checks arrays of parameters (one for each callback argument,
+        scalars are broadcast) against the declared ``parameters``, without
+        building anything. Returns a boolean array, True for each invalid
+        parameter set. Requires NumPy.
+        """
+        import numpy
+        columns, size = self._columns(arrays)
+        invalid = numpy.zeros(size, dtype=bool)
+        for parameter, column in zip(self.signature().parameters, columns):
+            invalid |= parameter.invalid(column)
+        return invalid
+    
+    def callback_batch(self, **arrays):
+        """Evaluates the model for many parameter sets at once.
+
+        Receives one array for each callback argument (scalars are
+        broadcast) and returns two 2-D arrays, with the numerator and the
+        denominator coefficients of each parameter set, padded with leading
+        zeros to a common degree. All the parameter sets are validated
+        first, and a ``ValueError`` is raised if any is invalid. Requires
+        NumPy.
+        """
+        self._check_batch(arrays)
+        return self._evaluate_batch(arrays)
+    
+    def _check_batch(self, arrays):
+        invalid = self.validate(**arrays)
+        if invalid.any():
+            rows = invalid.nonzero()[0]
+            raise ValueError('%d invalid parameter set(s), at rows: %s' % \
+                (len(rows), ', '.join(str(row) for row in rows[:10])))
+    
+    def _groups(self, columns, size):
+        # the integer arguments change the polynomial degrees, so the rows
+        # are evaluated in groups that share them. Yields the mask of the
+        # rows of each group and their arguments.
+        import numpy
+        positions = [self.args.index(arg) for arg in self.integer_args]
+        if positions:
+            keys = numpy.column_stack([columns[i].astype(int) \
+                for i in positions])
+            groups, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+        else:
+            groups = [()]
+            inverse = numpy.zeros(size, dtype=int)
+        for group, key in enumerate(groups):
+            mask = inverse == group
+            params = [column[mask] for column in columns]
+            for position, value in zip(positions, key):
+                params[position] = int(value)
+            yield mask, params
+    
+    def _evaluate_batch(self, arrays):
+        import numpy
+        columns, size = self._columns(arrays)
+        results = []
+        for mask, params in self._groups(columns, size):
+            num, den = self.coefficients(*params)
+            results.append((mask, num, den))
+
+        num_size = max(len(num) for mask, num, den in results)
+        den_size = max(len(den) for mask, num, den in results)
+        num_out = numpy.zeros((size, num_size))
+        den_out = numpy.zeros((size, den_size))
+        for mask, num, den in results:
+            rows = int(mask.sum())
+            for out, coefs, width in ((num_out, num, num_size),
+                                      (den_out, den, den_size)):
+                offset = width - len(coefs)
+                for i, coef in enumerate(coefs):
+                    out[mask, offset + i] = numpy.broadcast_to(coef, (rows,))
+        return num_out, den_out
+    
+    def step_formula(self, t, *args, **kwargs):
+        """Returns the closed-form unit step response at the times ``t``,
+        or None if the model doesn't have one.
+        """
+        return None
+    
+    def analytic_step(self, t, *args, **kwargs):
+        """Returns the unit step response at the times ``t`` (seconds, from
+        the step). The closed form of ``step_formula`` is used when the
+        model has one, otherwise the response is simulated with the
+        compiled model. Requires NumPy.
+        """
+        import numpy
+        t = numpy.asarray(t, dtype=float)
+        y = self.step_formula(t, *args, **kwargs)
+        if y is None:
+            samples = max(t.size, 1000)
+            grid = numpy.linspace(0, t.max() or 1.0, samples)
+            system = self.compile(grid[1], *args, **kwargs)
+            y = numpy.interp(t, grid, system.step_response(samples))
+        return y
+    
+    def discretize(self, Ts, method='zoh', exact_delay=False, **params):
+        """Returns the (b, a) difference-equation coefficients of the model
+        discretized with sample time ``Ts``, by ``zoh`` or ``tustin``. See
+        :func:`pidsim.models.lti.difference_equation`.
+
+        The parameters are given as keywords. With ``exact_delay``, the
+        dead time is modeled as a shift of ``round(dead_time / Ts)``
+        samples instead of with the Padé approximant. The read-only results
+        are cached per parameters, ``Ts`` and method. Requires NumPy.
+        """
+        from pidsim.models.lti import difference_equation
+        key = self._cache_key((), params)
+        if key is not None:
+            key = (float(Ts), method, bool(exact_delay)) + key
+
+        def build():
+            delay = 0
+            coefs_params = params
+            if exact_delay:
+                coefs_params, dead_time = self._without_dead_time(params)
+                delay = int(round(float(dead_time) / Ts))
+            num, den = self.coefficients(**coefs_params)
+            return difference_equation(num, den, Ts, method, delay)
+
+        return self._memoize('discretize', key, build)
+    
+    def dead_time(self, *args, **kwargs):
+        """Returns the dead time of the model, that ``callback``
+        approximates with a Padé approximant of order ``pade_order``.
+        """
+        return 0
+    
+    def _without_dead_time(self, params):
+        # the parameters without the Padé approximant of the dead time (of
+        # order 0, it is just 1), and the dead time, for the exact_delay
+        # variants that model it themselves. Without a dead time, the
+        # parameters are returned as they are.
+        import numpy
+        dead_time = self.dead_time(**params)
+        if not numpy.any(dead_time):
+            return params, dead_time
+        return dict(params, pade_order=0), dead_time
+    
+    def frequency_response(self, omega, exact_delay=False, form='tf',
+                           **params):
+        """Evaluates ``G(j omega)`` over the frequencies ``omega`` (rad/s).
+
+        The parameters are given as keywords, as in ``callback_batch``. If
+        any of them is an array, the magnitude and phase (radians, unwrapped
+        along the frequencies) are returned as 2-D arrays with one row per
+        parameter set, otherwise as 1-D arrays. With ``exact_delay``, the
+        dead time is evaluated as ``e^{-j omega Tt}`` instead of with the
+        Padé approximant. With ``form='zpk'``, the response is evaluated
+        factor by factor from ``zpk``, one parameter set at a time, which
+        is more accurate for high-order models. Requires NumPy.
+        """
+        import numpy
+        from pidsim.models.lti import zpk_response
+        batch = any(numpy.ndim(value) > 0 for value in params.values())
+        invalid = self.validate(**params)
+        if invalid.any():
+            raise ValueError('%d invalid parameter set(s)' % invalid.sum())
+        if exact_delay:
+            params, dead_time = self._without_dead_time(params)
+        s = 1j * numpy.asarray(omega, dtype=float).ravel()
+        if form == 'tf':
+            num, den = self._evaluate_batch(params)
+            response = _polyval_rows(num, s) / _polyval_rows(den, s)
+        elif form == 'zpk':
+            rows = _parameter_rows(params)
+            response = numpy.empty((len(rows), len(s)), dtype=complex)
+            for i, row in enumerate(rows):
+                response[i] = zpk_response(*self.zpk(**row) + (s,))
+        else:
+            raise ValueError('Unknown form: %s' % form)
+        if exact_delay:
+            delay = numpy.asarray(dead_time, dtype=float)
+            delay = numpy.broadcast_to(delay.ravel(), (len(response),))
+            response *= numpy.exp(-numpy.outer(delay, s))
+        magnitude = numpy.abs(response)
+        phase = numpy.unwrap(numpy.angle(response), axis=-1)
+        if not batch:
+            return magnitude[0], phase[0]
+        return magnitude, phase
+    
+    def coefficients_gradient(self, **params):
+        """Returns the numerator and the denominator coefficients, like
+        ``coefficients``, and a dict with their exact derivatives with
+        respect to each non-integer argument, as ``{arg: (dnum, dden)}``.
+
+        The parameters are given as keywords. The derivatives are computed
+        in a single evaluation of ``coefficients``, with
+        :class:`pidsim.models.dual.Dual` arguments.
+        """
+        from pidsim.models.dual import derivatives, value, variables
+        params = dict(self.signature().defaults, **params)
+        free = [arg for arg in self.args if arg not in self.integer_args]
+        duals = dict(zip(free, variables(*[params[arg] for arg in free])))
+        num, den = self.coefficients(**dict(params, **duals))
+        num_grads = [derivatives(coef, len(free)) for coef in num]
+        den_grads = [derivatives(coef, len(free)) for coef in den]
+        gradient = {}
+        for i, arg in enumerate(free):
+            gradient[arg] = ([grad[i] for grad in num_grads],
+                             [grad[i] for grad in den_grads])
+        return [value(coef) for coef in num], [value(coef) for coef in den], \
+            gradient
+    
+    def frequency_response_gradient(self, omega, exact_delay=False,
+                                    **params):
+        """Returns the complex response ``G(j omega)`` over the frequencies
+        ``omega`` (rad/s), for one parameter set given as keywords, and a
+        dict with its exact derivatives with respect to each non-integer
+        argument. See ``coefficients_gradient`` and ``frequency_response``.
+        Requires NumPy.
+        """
+        import numpy
+        from pidsim.models.dual import derivatives, value, variables
+        s = 1j * numpy.asarray(omega, dtype=float).ravel()
+        params = dict(self.signature().defaults, **params)
+        coefs_params = params
+        if exact_delay:
+            coefs_params = self._without_dead_time(params)[0]
+        num, den, gradient = self.coefficients_gradient(**coefs_params)
+        N = numpy.polyval(num, s)
+        D = numpy.polyval(den, s)
+        response = N / D
+        derivative = {}
+        for arg, (dnum, dden) in gradient.items():
+            derivative[arg] = (numpy.polyval(dnum, s) * D -
+                               N * numpy.polyval(dden, s)) / (D * D)
+        if exact_delay:
+            free = sorted(gradient, key=self.args.index)
+            duals = dict(zip(free, variables(*[params[arg] for arg in free])))
+            dead_time = self.dead_time(**dict(params, **duals))
+            delay = numpy.exp(-s * float(value(dead_time)))
+            for arg, grad in zip(free, derivatives(dead_time, len(free))):
+                derivative[arg] = (derivative[arg] - response * s * grad) * \
+                    delay
+            response = response * delay
+        return response, derivative
+    
+    def step_response_gradient(self, Ts, samples, **params):
+        """Returns the unit step response, at ``samples`` instants spaced by
+        ``Ts`` from the step, for one parameter set given as keywords, and
+        a dict with its exact derivatives with respect to each non-integer
+        argument. They are simulated together, with the zero-order hold
+        discretization of :func:`pidsim.models.lti.sensitivity_state_space`.
+        Requires NumPy.
+        """
+        import numpy
+        from pidsim.models.lti import sensitivity_state_space, zoh
+        num, den, gradient = self.coefficients_gradient(**params)
+        free = sorted(gradient, key=self.args.index)
+        A, B, C, D = sensitivity_state_space(
+            num, den, [gradient[arg] for arg in free])
+        Ad, Bd = zoh(A, B, Ts)
+        bd = Bd[:, 0]
+        d = D[:, 0]
+        out = numpy.empty((len(C), samples))
+        x = numpy.zeros(len(A))
+        for i in range(samples):
+            out[:, i] = numpy.dot(C, x) + d
+            x = numpy.dot(Ad, x) + bd
+        return out[0], dict(zip(free, out[1:]))
+    
+    @classmethod
+    def _get_cache(cls, name='callback'):
+        # the caches live in the class dict, so subclasses never share them
+        caches = cls.__dict__.get('_caches')
+        cache = caches.get(name) if caches is not None else None
+        maxsize = cls.callback_cache_size if name == 'callback' else \
+            cls.cache_size
+        if cache is None or cache.maxsize != maxsize:
+            with _class_lock:
+                caches = cls.__dict__.get('_caches')
+                if caches is None:
+                    caches = {}
+                    cls._caches = caches
+                cache = caches.get(name)
+                if cache is None or cache.maxsize != maxsize:
+                    cache = StripedLRUCache(maxsize,
+                                            '%s.%s' % (cls.__name__, name),
+                                            cls.cache_stripes)
+                    caches[name] = cache
+        return cache
+    
+    @classmethod
+    def cache_info(cls, name='callback'):
+        """Returns the hit/miss/eviction counters of one of the model caches
+        (``callback``, ``state_space``, ``zoh``, ``discretize``,
+        ``reduce`` or ``metrics``)."""
+        return cls._get_cache(name).stats()
+    
+    @classmethod
+    def cache_clear(cls):
+        for cache in cls.__dict__.get('_caches', {}).values():
+            cache.clear()
+    
+    def _cache_key(self, args, kwargs):
+        names = self.args
+        if len(args) + len(kwargs) != len(names):
+            return None
+        try:
+            if kwargs:
+                args = tuple(args) + tuple(kwargs[name] \
+                                           for name in names[len(args):])
+            return tuple(map(float, args))
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    def _memoize(self, name, key, builder):
+        if key is None:
+            # let the builder itself complain about bad arguments
+            return builder()
+        cache = self._get_cache(name)
+        value = cache.get(key, _missing)
+        if value is _missing:
+            value = builder()
+            cache.set(key, value)
+        return value
+    
+    def _dispatch_callback(self, *args, **kwargs):
+        if instrumentation.enabled:
+            return self._instrumented_callback(args, kwargs)
+        if self.callback_cache_size > 0:
+            return self._cached_callback(args, kwargs)
+        return self._uncached_callback(*args, **kwargs)
+    
+    def _instrumented_callback(self, args, kwargs):
+        start = default_timer()
+        if self.callback_cache_size > 0:
+            value = self._cached_callback(args, kwargs)
+        else:
+            value = self._uncached_callback(*args, **kwargs)
+        seconds = default_timer() - start
+        try:
+            order = len(value.den) - 1
+        except (AttributeError, TypeError):
+            order = None
+        instrumentation.record_call(type(self).__name__,
+                                    self._cache_key(args, kwargs) or args,
+                                    seconds, order)
+        return value
+    
+    def _cached_callback(self, args, kwargs):
+        # the coefficients of what callback built are cached as immutable
+        # tuples, and a new tf is built from them on every hit, so the
+        # caller always owns the returned tf.
+        key = self._cache_key(args, kwargs)
+        if key is None:
+            # let the callback itself complain about bad arguments
+            return self._uncached_callback(*args, **kwargs)
+        cache = self._get_cache('callback')
+        coefficients = cache.get(key, _missing)
+        if coefficients is _missing:
+            value = self._uncached_callback(*args, **kwargs)
+            cache.set(key, (tuple(value.num), tuple(value.den)))
+            return value
+        return tf(list(coefficients[0]), list(coefficients[1]))
+    
+    def to_state_space(self, *args, **kwargs):
+        """Returns the (A, B, C, D) matrices of a realization of the model,
+        as read-only arrays. It is the controllable canonical form of the
+        expanded transfer function, or, with the ``form='zpk'`` keyword,
+        the series connection of the second order sections of ``zpk``.
+        Requires NumPy.
+        """
+        from pidsim.models.lti import sos_state_space, state_space, \
+            zpk_to_sos
+        form = kwargs.pop('form', 'tf')
+        if form == 'tf':
+            builder = lambda: state_space(*self.coefficients(*args, **kwargs))
+        elif form == 'zpk':
+            builder = lambda: sos_state_space(
+                zpk_to_sos(*self.zpk(*args, **kwargs)))
+        else:
+            raise ValueError('Unknown form: %s' % form)
+        key = self._cache_key(args, kwargs)
+        if key is not None:
+            key = (form,) + key
+        return self._memoize('state_space', key, builder)
+    
+    def reduce(self, *args, **kwargs):
+        """Returns a :class:`pidsim.models.lti.ReducedSystem`, with a lower
+        order realization of the model, obtained by balanced truncation of
+        ``to_state_space``, and its error bound. The ``tolerance`` and
+        ``order`` keywords are passed to
+        :func:`pidsim.models.lti.balanced_truncation`, and ``form`` (by
+        default ``zpk``, that is better conditioned for high orders) to
+        ``to_state_space``. The results are cached per parameters. Requires
+        NumPy.
+        """
+        from pidsim.models.lti import balanced_truncation
+        tolerance = kwargs.pop('tolerance', None)
+        order = kwargs.pop('order', None)
+        form = kwargs.pop('form', 'zpk')
+        key = self._cache_key(args, kwargs)
+        if key is not None:
+            key = (tolerance, order, form) + key
+        return self._memoize('reduce', key, lambda: balanced_truncation(
+            *self.to_state_space(form=form, *args, **kwargs),
+            tolerance=tolerance, order=order))
+    
+    def compile(self, Ts, *args, **kwargs):
+        """Returns a :class:`pidsim.models.lti.DiscreteSystem` with the
+        zero-order hold discretization of the model, for the sample time
+        ``Ts``. The ``form`` keyword is passed to ``to_state_space``. With
+        the ``tolerance`` keyword, the realization is reduced first, within
+        that error bound (see ``reduce``). Requires NumPy.
+        """
+        from pidsim.models.lti import DiscreteSystem, zoh
+        form = kwargs.pop('form', 'tf')
+        tolerance = kwargs.pop('tolerance', None)
+        if tolerance is None:
+            A, B, C, D = self.to_state_space(form=form, *args, **kwargs)
+        else:
+            A, B, C, D = self.reduce(tolerance=tolerance, form=form, *args,
+                                     **kwargs)[:4]
+        key = self._cache_key(args, kwargs)
+        if key is not None:
+            key = (float(Ts), form, tolerance) + key
+        Ad, Bd = self._memoize('zoh', key, lambda: zoh(A, B, Ts))
+        return DiscreteSystem(Ad, Bd, C, D, Ts)
+    
+    def get(self, key, locale=_missing):
+        """Returns the ``key`` attribute (e.g. ``name``), translated to
+        ``locale``, or to the locale of the instance if not given."""
+        if locale is _missing:
+            locale = self._locale
         attr = getattr(self, key, None)
         if attr is not None:
-            for locale, string in attr:
-                if locale == self._locale:
-                    return string
-            return attr[0][1]
+            if not isinstance(attr, I18nStr):
+                attr = I18nStr(attr)
+            return attr(locale)
 
 
 class I18nStr(list):
+    """List of (locale, string) pairs, callable with a locale.
+
+    The lookup falls back from the locale (e.g. ``pt_BR``) to its language
+    (``pt``), then to any locale of that language and finally to the first
+    string. The lookup tables are built on construction, so the list
+    shouldn't be changed afterwards.
+    """
+    
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._strings = {}
+        self._languages = {}
+        for locale, string in self:
+            self._strings.setdefault(locale, string)
+            self._languages.setdefault(_language(locale), string)
+        self._resolved = {}
     
     def __call__(self, locale):
-        for my_locale, string in self:
-            if my_locale == locale:
-                return string
-        return self[0][1]
+        string = self._resolved.get(locale, _missing)
+        if string is _missing:
+            string = self._strings.get(locale, _missing)
+            if string is _missing:
+                language = _language(locale)
+                string = self._strings.get(language, _missing)
+                if string is _missing:
+                    string = self._languages.get(language, self[0][1])
+            self._resolved[locale] = string
+        return string
+
+
+def _polyval_rows(coefs, x):
+    # Horner evaluation of each row of coefs over all the points of x
+    import numpy
+    result = numpy.zeros((len(coefs), len(x)), dtype=complex)
+    for column in coefs.T:
+        result *= x
+        result += column[:, numpy.newaxis]
+    return result
+
+
+def _parameter_rows(params):
+    # splits keyword arrays of parameters in one dict per parameter set
+    import numpy
+    if not params:
+        return [{}]
+    names = list(params)
+    columns = numpy.broadcast_arrays(*[numpy.asarray(params[name]).ravel() \
+                                       for name in names])
+    return [dict((name, column[i].item()) \
+                 for name, column in zip(names, columns)) \
+            for i in range(len(columns[0]))]
+
+
+def _root_array(roots, rows):
+    # stacks the roots returned by zpk (scalars or arrays) in the columns
+    # of a complex (rows, len(roots)) array
+    import numpy
+    result = numpy.empty((rows, len(roots)), dtype=complex)
+    for i, root in enumerate(roots):
+        result[:, i] = root
+    return result
+
+
+def _metrics_arrays(zeros, poles, gain, dead_time):
+    # ReferenceModel._metrics over rows of roots, NaN for the missing ones
+    import numpy
+    zeros_abs = numpy.abs(zeros)
+    poles_abs = numpy.abs(poles)
+    scale = numpy.concatenate([numpy.nan_to_num(poles_abs),
+                               numpy.nan_to_num(zeros_abs),
+                               numpy.ones((len(gain), 1))], axis=1).max(axis=1)
+    tolerance = 1e-12 * scale[:, numpy.newaxis]
+    with numpy.errstate(invalid='ignore'):
+        origin = poles_abs <= tolerance
+        axis = numpy.abs(poles.real) <= tolerance
+        left = poles.real < -tolerance
+        right = poles.real > tolerance
+        close = numpy.abs(poles[:, :, numpy.newaxis] -
+                          poles[:, numpy.newaxis, :]) <= \
+            tolerance[:, :, numpy.newaxis]
+        right_zeros = zeros.real > tolerance
+    pairs = numpy.triu(numpy.ones(close.shape[1:], dtype=bool), 1)
+    repeated = (close & axis[:, :, numpy.newaxis] & axis[:, numpy.newaxis, :]
+                & pairs).any(axis=(1, 2))
+    has_origin = origin.any(axis=1)
+    has_right = right.any(axis=1)
+    with numpy.errstate(all='ignore'):
+        dc_gain = gain * numpy.prod(numpy.where(numpy.isnan(zeros), 1,
+                                                -zeros), axis=1) / \
+            numpy.prod(numpy.where(numpy.isnan(poles), 1, -poles), axis=1)
+    dc_gain = numpy.where(has_origin, numpy.inf, dc_gain.real)
+    slowest = numpy.where(left, poles.real, -numpy.inf).max(
+        axis=1, initial=-numpy.inf)
+    with numpy.errstate(divide='ignore'):
+        time_constant = numpy.where(left.any(axis=1), -1.0 / slowest,
+                                    numpy.nan)
+    return (dc_gain,
+            time_constant,
+            ~axis.any(axis=1) & ~has_right,
+            has_origin & (axis.sum(axis=1) == origin.sum(axis=1)) &
+                ~has_right & ~repeated,
+            has_right | repeated,
+            ~right_zeros.any(axis=1) & (dead_time == 0))
+
+
+def _language(locale):
+    return (locale or '').replace('-', '_').split('_', 1)[0]
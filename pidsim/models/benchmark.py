@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Benchmarks for the hot paths of the reference models.
+
+    Run it with ``python -m pidsim.models.benchmark``. The results are
+    written as JSON (``--output``), and can be compared against a saved
+    baseline (``--baseline``), failing if any benchmark got slower than the
+    given tolerance.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['PARAMETER_SETS', 'REPEAT', 'MIN_TIME', 'bench_repeated_poles',
+           'bench_import_time', 'bench_callbacks', 'bench_step_responses',
+           'bench_frequency_responses', 'bench_threads', 'run', 'compare',
+           'main']
+
+import json
+import platform
+import subprocess
+import sys
+import threading
+import timeit
+
+from pidsim.models import __version__
+from pidsim.models.base import tf, poly
+from pidsim.models.models import index
+from pidsim.models.polynomial import binomial
+
+# parameter sets used for each model of the index, from the suggested
+# values in the model descriptions.
+PARAMETER_SETS = {
+    1: [(1, 1)],
+    2: [(1, 1, 2)],
+    3: [(1, 1, 2)],
+    4: [(1, 1, 2, 3, 0.5, 1, order) for order in (1, 2, 3)],
+    5: [(n,) for n in (1, 2, 3, 4, 8)],
+    6: [(alpha,) for alpha in (0.1, 0.2, 0.5, 1)],
+    7: [(alpha,) for alpha in (0.1, 0.2, 0.5, 1, 2, 5)],
+    8: [(1, order) for order in (1, 2, 3)],
+    9: [(1, order) for order in (1, 2, 3)],
+    10: [()],
+    11: [()],
+    12: [(omega, 0.1) for omega in (1, 2, 5, 10)],
+    13: [()],
+    14: [(1, order) for order in (1, 2, 3)],
+}
+
+
+# each timing is taken this many times
+REPEAT = 11
+
+# each repeat runs for at least this many seconds, so the timer resolution
+# and the scheduler jitter are small next to it.
+MIN_TIME = 0.005
+
+
+class _Timing(float):
+    # the best of the timings, in seconds, with the median of their ratios
+    # to a calibration workload timed right before each of them
+    
+    def __new__(cls, seconds, relative):
+        timing = float.__new__(cls, seconds)
+        timing.relative = relative
+        return timing
+
+
+def _python_work():
+    # fixed pure Python workload, that doesn't depend on the package
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+
+def _numpy_work():
+    # fixed numpy workload, for the benchmarks that spend their time in
+    # numpy: it doesn't slow down by the same ratio as Python code does
+    import numpy
+    s = 1j * numpy.logspace(-2, 2, 1000)
+    for i in range(10):
+        numpy.exp(-s) / (s * s + s + 1)
+
+
+_calibrations = {}
+
+
+def _calibrate(work):
+    # seconds of one run of a batch of the calibration workload
+    if work not in _calibrations:
+        timer = timeit.Timer(work)
+        number = 1
+        while timer.timeit(number) < MIN_TIME:
+            number *= 2
+        _calibrations[work] = (timer, number)
+    timer, number = _calibrations[work]
+    return timer.timeit(number) / number
+
+
+def _measure(sample, repeat=REPEAT, work=_python_work):
+    # calls sample(), that returns seconds, repeat times. The speed of the
+    # machine drifts over time (frequency scaling, other processes), and
+    # by as much as the regressions to catch, but the ratio to the
+    # calibration work timed just before stays put.
+    seconds = []
+    ratios = []
+    for i in range(repeat):
+        calibration = _calibrate(work)
+        value = sample()
+        seconds.append(value)
+        ratios.append(value / calibration)
+    ratios.sort()
+    return _Timing(min(seconds), ratios[len(ratios) // 2])
+
+
+def _best(func, number, repeat=REPEAT, work=_python_work):
+    timer = timeit.Timer(func)
+    # number is only the minimum: it is doubled until a repeat is long
+    # enough to be measured reliably
+    while timer.timeit(number) < MIN_TIME:
+        number *= 2
+    return _measure(lambda: timer.timeit(number) / number, repeat, work)
+
+
+def bench_repeated_poles(orders=(1, 2, 3, 4, 8, 16, 32, 50, 100),
+                         number=200):
+    """Compares the ``1 / (s+1)^n`` transfer function of Model5 built as
+    the callback used to, multiplying ``n`` ``pidsim.core.types.poly``
+    objects, with the direct binomial expansion it uses now. Returns a
+    list of ``(n, multiply_seconds, binomial_seconds)`` tuples.
+    """
+    def multiply(n):
+        a = poly([1, 1])
+        for i in range(1, n):
+            a = a * poly([1, 1])
+        return tf([1], list(a))
+
+    results = []
+    for n in orders:
+        before = _best(lambda: multiply(n), number)
+        after = _best(lambda: tf([1], binomial(n)), number)
+        results.append((n, before, after))
+    return results
+
+
+def bench_import_time(module='pidsim.models.models'):
+    """Imports ``module`` in a fresh interpreter with ``-X importtime``
+    (Python 3.7 or newer) and returns a dict with its cumulative import
+    time, in microseconds, and the list of the ``pidsim.core`` modules it
+    pulled in. Raises ``RuntimeError`` if the import fails.
+    """
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                                'import %s' % module],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = process.communicate()[1].decode('utf-8', 'replace')
+    if process.returncode != 0:
+        raise RuntimeError('Importing %s failed:\n%s' % (module, stderr))
+    cumulative = None
+    core = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = [field.strip() for field in line[12:].split('|')]
+        if len(fields) != 3 or not fields[1].isdigit():
+            continue
+        name = fields[2]
+        if name == module:
+            cumulative = int(fields[1])
+        if name.startswith('pidsim.core'):
+            core.append(name)
+    if cumulative is None:
+        raise RuntimeError('No import time reported for %s' % module)
+    return {'module': module, 'cumulative_us': cumulative,
+            'core_modules': core}
+
+
+def bench_callbacks(number=200):
+    """Times ``callback`` of every model, for each of its parameter sets,
+    both memoized and bypassing the cache. Returns a dict of seconds per
+    call.
+    """
+    results = {}
+    for model_id, parameter_sets in sorted(PARAMETER_SETS.items()):
+        model = index[model_id](None)
+        callback = type(model).callback
+        for params in parameter_sets:
+            name = 'model%d%s' % (model_id, _suffix(params))
+            results[name + '.callback'] = _best(
+                lambda: model.callback(*params), number)
+            results[name + '.callback_uncached'] = _best(
+                lambda: callback(model, *params), number)
+    return results
+
+
+def bench_step_responses(samples=1000, number=3):
+    """Times the batched step response of all the parameter sets of each
+    model. Returns a dict of seconds per batch.
+    """
+    from pidsim.models.simulation import step_responses
+    results = {}
+    for model_id, parameter_sets in sorted(PARAMETER_SETS.items()):
+        systems = [(model_id, params) for params in parameter_sets]
+        results['model%d.step_responses' % model_id] = _best(
+            lambda: step_responses(systems, 20, samples), number,
+            work=_numpy_work)
+    return results
+
+
+def bench_frequency_responses(points=1000, number=20):
+    """Times the frequency response of every model, for all its parameter
+    sets at once. Returns a dict of seconds per evaluation.
+    """
+    import numpy
+    omega = numpy.logspace(-2, 2, points)
+    results = {}
+    for model_id, parameter_sets in sorted(PARAMETER_SETS.items()):
+        model = index[model_id](None)
+        columns = zip(*parameter_sets)
+        params = dict((arg, numpy.array(column, dtype=float)) \
+            for arg, column in zip(model.args, columns))
+        results['model%d.frequency_response' % model_id] = _best(
+            lambda: model.frequency_response(omega, **params), number,
+            work=_numpy_work)
+    return results
+
+
+def _run_threads(count, target):
+    # runs target(i) in count threads, released together
+    start = threading.Event()
+    threads = [threading.Thread(target=lambda i=i: (start.wait(), target(i)))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    begin = timeit.default_timer()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return timeit.default_timer() - begin
+
+
+def bench_threads(threads=(1, 2, 4, 8), calls=2000):
+    """Measures the throughput of ``callback`` on the shared instances of
+    :meth:`ReferenceModel.for_locale`, called from several threads at once
+    over all the parameter sets. Returns a dict of seconds per call, for
+    each number of threads.
+    """
+    work = [(index[model_id].for_locale(None), params)
+            for model_id, parameter_sets in sorted(PARAMETER_SETS.items())
+            for params in parameter_sets]
+    results = {}
+    for count in threads:
+        per_thread = calls // count
+
+        def target(i):
+            for j in range(per_thread):
+                model, params = work[(i + j) % len(work)]
+                model.callback(*params)
+
+        results['threads_%d.callback' % count] = _measure(
+            lambda: _run_threads(count, target) / (per_thread * count))
+    return results
+
+
+def _suffix(params):
+    return ''.join('_%g' % value for value in params)
+
+
+def run(quick=False):
+    """Runs all the benchmarks, and returns a dict with the environment
+    and the results, in seconds.
+    """
+    scale = 10 if quick else 1
+    results = bench_callbacks(number=200 // scale)
+    results.update(bench_threads(calls=2000 // scale))
+    for n, multiply, direct in bench_repeated_poles(number=200 // scale):
+        results['repeated_poles_%d.multiply' % n] = multiply
+        results['repeated_poles_%d.binomial' % n] = direct
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        results.update(bench_step_responses(number=max(1, 3 // scale)))
+        results.update(bench_frequency_responses(number=20 // scale))
+    if sys.version_info >= (3, 7):
+        # -X importtime is only available since Python 3.7
+        results['import_time.pidsim.models.models'] = _measure(
+            lambda: bench_import_time()['cumulative_us'] / 1e6)
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'results': results,
+        'relative': dict((name, seconds.relative) \
+                         for name, seconds in results.items() \
+                         if isinstance(seconds, _Timing)),
+    }
+
+
+def compare(current, baseline, tolerance=0.2, floor=2e-6):
+    """Compares two results dicts returned by :func:`run`. Returns a sorted
+    list of ``(name, baseline_seconds, current_seconds)`` tuples for the
+    benchmarks that got slower than ``1 + tolerance`` times the baseline,
+    and by more than ``floor`` seconds.
+
+    When both have them, the ``relative`` timings must have slowed down
+    by the same ratio: each is the median ratio of a benchmark to a fixed
+    calibration workload timed right before it, so it doesn't change when
+    the whole machine gets faster or slower between or during the runs,
+    as the seconds do. A real regression shows in both.
+    """
+    current_relative = current.get('relative', {})
+    baseline_relative = baseline.get('relative', {})
+    regressions = []
+    for name, seconds in sorted(current['results'].items()):
+        reference = baseline['results'].get(name)
+        if not reference or seconds <= reference * (1 + tolerance) or \
+                seconds - reference <= floor:
+            continue
+        if name in current_relative and name in baseline_relative and \
+                current_relative[name] <= \
+                baseline_relative[name] * (1 + tolerance):
+            continue
+        regressions.append((name, reference, seconds))
+    return regressions
+
+
+def _run_fresh(quick=False):
+    # runs the benchmarks again in a new interpreter: some timings depend
+    # on the state of the one that ran them (memory layout, what ran
+    # before), and that stays the same for all the runs in it
+    command = [sys.executable, '-m', 'pidsim.models.benchmark']
+    if quick:
+        command.append('--quick')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    stdout = process.communicate()[0]
+    if process.returncode != 0:
+        raise RuntimeError('Running the benchmarks failed')
+    return json.loads(stdout.decode('utf-8'))
+
+
+def _best_of(current, other):
+    # the results of current, with the faster timings of other
+    merged = dict(current)
+    for key in ('results', 'relative'):
+        values = dict(current.get(key, {}))
+        for name, value in other.get(key, {}).items():
+            values[name] = min(values.get(name, value), value)
+        merged[key] = values
+    return merged
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the pidsim reference models.')
+    parser.add_argument('-o', '--output', help='write the results to a JSON '
+                        'file, instead of stdout')
+    parser.add_argument('-b', '--baseline', help='JSON file with baseline '
+                        'results to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='allowed slowdown ratio (default: 0.2)')
+    parser.add_argument('-f', '--floor', type=float, default=2e-6,
+                        help='slowdowns up to this many seconds are '
+                        'ignored (default: 2e-6)')
+    parser.add_argument('-r', '--retries', type=int, default=3,
+                        help='times to run the benchmarks again while some '
+                        'look slower than the baseline (default: 3)')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='run fewer iterations')
+    args = parser.parse_args(argv)
+    current = run(quick=args.quick)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        regressions = compare(current, baseline, args.tolerance, args.floor)
+        for attempt in range(args.retries):
+            if not regressions:
+                break
+            # a real regression shows up in every run, the noise of the
+            # machine doesn't: keep the best timings of all the runs
+            current = _best_of(current, _run_fresh(args.quick))
+            regressions = compare(current, baseline, args.tolerance,
+                                  args.floor)
+    dump = json.dumps(current, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(dump + '\n')
+    else:
+        print(dump)
+    if args.baseline:
+        for name, reference, seconds in regressions:
+            sys.stderr.write('REGRESSION %s: %.3gs -> %.3gs (%+.0f%%)\n' % \
+                (name, reference, seconds, (seconds / reference - 1) * 100))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.cache
+    ~~~~~~~~~~~~~~~~~~~
+
+    Caching utilities.
+
+    The caches are safe to share between threads: each :class:`LRUCache`
+    has its own lock, and a :class:`StripedLRUCache` spreads the keys over
+    several of them, so concurrent lookups of different keys rarely wait
+    for each other.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['LRUCache', 'StripedLRUCache']
+
+import threading
+from collections import OrderedDict
+
+from pidsim.models import instrumentation
+
+_missing = object()
+
+
+class LRUCache(object):
+    """Size-bounded mapping that evicts the least recently used entry.
+
+    A ``maxsize`` of 0 disables the cache: nothing is ever stored. The
+    ``name`` identifies the cache in the instrumentation events.
+    """
+
+    def __init__(self, maxsize=128, name=None):
+        self.maxsize = maxsize
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, _missing)
+            if value is _missing:
+                self.misses += 1
+            else:
+                self._data[key] = value
+                self.hits += 1
+        if instrumentation.enabled:
+            instrumentation.record_cache(self.name, value is not _missing)
+        return default if value is _missing else value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class StripedLRUCache(object):
+    """:class:`LRUCache` split in ``stripes`` independently locked parts,
+    selected by the hash of the key, with ``maxsize`` entries in total.
+    The eviction order is only kept within each part.
+    """
+
+    def __init__(self, maxsize=128, name=None, stripes=8):
+        self.maxsize = maxsize
+        self.name = name
+        stripes = max(1, min(stripes, maxsize)) if maxsize > 0 else 1
+        # the first maxsize % stripes parts get one more entry, so the
+        # sizes add up to maxsize exactly
+        size, extra = divmod(max(maxsize, 0), stripes)
+        self._stripes = [LRUCache(size + (i < extra), name) \
+                         for i in range(stripes)]
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get(self, key, default=None):
+        return self._stripe(key).get(key, default)
+
+    def set(self, key, value):
+        self._stripe(key).set(key, value)
+
+    def clear(self):
+        for stripe in self._stripes:
+            stripe.clear()
+
+    def stats(self):
+        stats = dict.fromkeys(('hits', 'misses', 'evictions', 'size'), 0)
+        for stripe in self._stripes:
+            for name, value in stripe.stats().items():
+                if name in stats:
+                    stats[name] += value
+        stats['maxsize'] = self.maxsize
+        stats['stripes'] = len(self._stripes)
+        return stats
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self._stripes)
+
+    def __contains__(self, key):
+        return key in self._stripe(key)
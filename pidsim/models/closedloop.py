@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.closedloop
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Closed-loop evaluation of PID controllers over the reference models.
+    Requires NumPy.
+
+    The controller is the parallel PID with a filtered derivative::
+
+        C(s) = Kp + Ki / s + Kd s / (Tf s + 1)
+
+    in a unity feedback loop with the plant. For a grid of gains, the
+    closed loops are built as a stack of state-space systems, discretized
+    together (the zero-order hold is exact for the step reference) and
+    simulated in the same pass, and the performance metrics are accumulated
+    sample by sample.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['ClosedLoopResult', 'closed_loop', 'evaluate']
+
+from collections import namedtuple
+
+import numpy
+
+from pidsim.models.lti import expm
+from pidsim.models.simulation import build_model
+
+ClosedLoopResult = namedtuple('ClosedLoopResult', 't y iae ise overshoot '
+                              'settling_time stable')
+
+
+def closed_loop(A, B, C, D, Kp, Ki, Kd, Tf):
+    """Returns the (A, B, C, D) arrays of the closed loops of the plant
+    ``(A, B, C, D)`` with the PID controllers of the 1-D gain arrays, from
+    the reference to the plant output. The shapes are (k, n, n), (k, n),
+    (k, n) and (k,), for k gain sets and n = plant order + 2 (the
+    integrator and the derivative filter states).
+    """
+    A = numpy.asarray(A, dtype=float)
+    order = len(A)
+    size = order + 2
+    count = len(Kp)
+    c = numpy.asarray(C, dtype=float)[0]
+    b = numpy.asarray(B, dtype=float)[:, 0]
+    d = float(numpy.asarray(D)[0, 0])
+    # u = g e + Ki xi - h xf, with g = Kp + Kd / Tf and h = Kd / Tf
+    h = Kd / Tf
+    g = Kp + h
+    loop = 1 + g * d
+    if numpy.any(loop == 0):
+        raise ValueError('The closed loop is not well-posed.')
+    q = 1.0 / loop
+    # u = Ux z + Ur r, for the state z = [x, xi, xf]
+    Ux = numpy.zeros((count, size))
+    Ux[:, :order] = -(q * g)[:, None] * c
+    Ux[:, order] = q * Ki
+    Ux[:, order + 1] = -q * h
+    Ur = q * g
+    # y = Yx z + Yr r, and e = r - y
+    Yx = d * Ux
+    Yx[:, :order] += c
+    Yr = d * Ur
+    Acl = numpy.zeros((count, size, size))
+    Acl[:, :order, :order] = A
+    Acl[:, :order, :] += b[None, :, None] * Ux[:, None, :]
+    Acl[:, order, :] = -Yx
+    Acl[:, order + 1, :] = -Yx / Tf
+    Acl[:, order + 1, order + 1] -= 1.0 / Tf
+    Bcl = numpy.zeros((count, size))
+    Bcl[:, :order] = b[None, :] * Ur[:, None]
+    Bcl[:, order] = 1 - Yr
+    Bcl[:, order + 1] = (1 - Yr) / Tf
+    return Acl, Bcl, Yx, Yr
+
+
+def _evaluate(A, B, C, D, Kp, Ki, Kd, Tf, Ts, samples, band, responses):
+    Acl, Bcl, Ccl, Dcl = closed_loop(A, B, C, D, Kp, Ki, Kd, Tf)
+    count, size = Bcl.shape
+    stable = numpy.all(numpy.linalg.eigvals(Acl).real < 0, axis=-1)
+    # exact discretization of the augmented system [A B; 0 0]
+    M = numpy.zeros((count, size + 1, size + 1))
+    M[:, :size, :size] = Acl
+    M[:, :size, size] = Bcl
+    E = expm(M * Ts)
+    Ad = numpy.ascontiguousarray(E[:, :size, :size])
+    Bd = numpy.ascontiguousarray(E[:, :size, size])
+
+    y_out = numpy.empty((count, samples)) if responses else None
+    iae = numpy.zeros(count)
+    ise = numpy.zeros(count)
+    peak = numpy.full(count, -numpy.inf)
+    last_outside = numpy.full(count, -1)
+    z = numpy.zeros((count, size))
+    az = numpy.empty((count, size))
+    y = numpy.empty(count)
+    with numpy.errstate(all='ignore'):
+        for i in range(samples):
+            # unit step reference: y = Ccl z + Dcl, z = Ad z + Bd
+            numpy.einsum('kn,kn->k', Ccl, z, out=y)
+            y += Dcl
+            if responses:
+                y_out[:, i] = y
+            e = 1 - y
+            weight = 0.5 if i in (0, samples - 1) else 1.0
+            iae += weight * numpy.abs(e)
+            ise += weight * e * e
+            numpy.maximum(peak, y, out=peak)
+            last_outside[~(numpy.abs(e) <= band)] = i
+            numpy.einsum('kmn,kn->km', Ad, z, out=az)
+            numpy.add(az, Bd, out=z)
+    iae *= Ts
+    ise *= Ts
+    overshoot = numpy.maximum(peak - 1, 0) * 100
+    settling_time = (last_outside + 1) * Ts
+    settling_time[last_outside == samples - 1] = numpy.inf
+    for metric in (iae, ise, overshoot, settling_time):
+        metric[~stable] = numpy.inf
+    return y_out, iae, ise, overshoot, settling_time, stable
+
+
+def evaluate(model_id, params, Kp, Ki, Kd, t_final, samples=1000, Tf=None,
+             band=0.02, responses=True, workers=None, form='tf'):
+    """Evaluates the closed-loop unit step responses of the plant
+    ``(model id, params)`` (as in :mod:`pidsim.models.simulation`) with the
+    PID controllers of the gain arrays ``Kp``, ``Ki`` and ``Kd``, broadcast
+    to a common shape (e.g. from ``numpy.meshgrid``).
+
+    ``Tf`` is the time constant of the derivative filter, by default the
+    sample time ``t_final / (samples - 1)``. Returns a
+    :class:`ClosedLoopResult` with the time vector, the responses (one row
+    per gain set, with the gain shape plus the samples axis, or None if not
+    ``responses``) and, with the gain shape:
+
+    - ``iae`` and ``ise``, the integrals of the absolute and squared error;
+    - ``overshoot``, the peak above the reference, in percent;
+    - ``settling_time``, when the output enters the ``band`` around the
+      reference for good (``inf`` if it doesn't within ``t_final``);
+    - ``stable``, whether the closed loop is stable. The metrics of the
+      unstable loops are ``inf``.
+
+    If ``workers`` is given, the gain sets are split in chunks simulated by
+    a ``concurrent.futures.ProcessPoolExecutor`` with that many processes.
+    """
+    model, args, kwargs = build_model(model_id, params)
+    A, B, C, D = model.to_state_space(form=form, *args, **kwargs)
+    Kp, Ki, Kd = numpy.broadcast_arrays(*[numpy.asarray(gain, dtype=float)
+                                          for gain in (Kp, Ki, Kd)])
+    shape = Kp.shape
+    Kp, Ki, Kd = Kp.ravel(), Ki.ravel(), Kd.ravel()
+    Ts = float(t_final) / (samples - 1)
+    if Tf is None:
+        Tf = Ts
+    t = numpy.arange(samples) * Ts
+    common = (Tf, Ts, samples, band, responses)
+    if not workers or len(Kp) < 2:
+        results = _evaluate(A, B, C, D, Kp, Ki, Kd, *common)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        chunk_size = -(-len(Kp) // workers)
+        chunks = [slice(i, i + chunk_size)
+                  for i in range(0, len(Kp), chunk_size)]
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = [executor.submit(_evaluate, A, B, C, D, Kp[chunk],
+                                       Ki[chunk], Kd[chunk], *common)
+                       for chunk in chunks]
+            parts = [future.result() for future in futures]
+        finally:
+            executor.shutdown()
+        results = [None if not responses and i == 0 else
+                   numpy.concatenate([part[i] for part in parts])
+                   for i in range(6)]
+    y, iae, ise, overshoot, settling_time, stable = results
+    if y is not None:
+        y = y.reshape(shape + (samples,))
+    return ClosedLoopResult(t, y, iae.reshape(shape), ise.reshape(shape),
+                            overshoot.reshape(shape),
+                            settling_time.reshape(shape),
+                            stable.reshape(shape))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.delay
+    ~~~~~~~~~~~~~~~~~~~
+
+    Dead time handling.
+
+    The Padé approximants returned by ``pidsim.core.pade`` are interned,
+    keyed by (order, dead time), so models that always use the same
+    approximant (e.g. the unit delay of Model8, Model9 and Model14) build
+    it only once.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['approximant', 'orders', 'pade_zpk', 'stats', 'clear']
+
+from pidsim.models.cache import StripedLRUCache
+from pidsim.models.polynomial import pade
+
+_approximants = StripedLRUCache(256, name='pade')
+_unit_roots = {}
+
+
+def approximant(order, dead_time):
+    """Returns the Padé approximant of ``e^{-dead_time s}``, as a
+    ``pidsim.core.types.tf``. The returned object is shared, so it should
+    only be used as an operand, never mutated.
+    """
+    key = (int(order), float(dead_time))
+    value = _approximants.get(key)
+    if value is None:
+        from pidsim.core.pade import index as pade_index
+        value = pade_index[key[0]](dead_time)
+        _approximants.set(key, value)
+    return value
+
+
+def orders():
+    """Returns the Padé approximant orders available in pidsim.core."""
+    from pidsim.core.pade import index as pade_index
+    return sorted(pade_index)
+
+
+def pade_zpk(order, dead_time):
+    """Returns the zeros, poles and gain of the diagonal Padé approximant
+    of ``e^{-dead_time s}``. The roots of the unit-delay approximant are
+    computed once per order and scaled by ``1 / dead_time``. The dead time
+    may be an array, as in :func:`pidsim.models.polynomial.pade`: the roots
+    and the gain are then arrays too, the roots NaN where the dead time is
+    zero. Requires NumPy.
+    """
+    import numpy
+    order = int(order)
+    array = numpy.ndim(dead_time) > 0
+    if not array and dead_time == 0:
+        return [], [], 1
+    roots = _unit_roots.get(order)
+    if roots is None:
+        num, den = pade(order, 1)
+        roots = (tuple(numpy.roots(num)), tuple(numpy.roots(den)))
+        _unit_roots[order] = roots
+    zeros, poles = roots
+    if array:
+        dead_time = numpy.asarray(dead_time, dtype=float)
+        none = dead_time == 0
+        with numpy.errstate(divide='ignore'):
+            scale = numpy.where(none, numpy.nan, 1 / dead_time)
+        return ([zero * scale for zero in zeros],
+                [pole * scale for pole in poles],
+                numpy.where(none, 1, (-1) ** order))
+    return ([zero / dead_time for zero in zeros],
+            [pole / dead_time for pole in poles], (-1) ** order)
+
+
+def stats():
+    """Returns the counters of the approximant cache, including the hit
+    rate. The models look the approximants up on each callback that isn't
+    served by their own callback cache, so the hit rate tells how often
+    those calls reuse an approximant of another parameter set or model.
+    """
+    result = _approximants.stats()
+    calls = result['hits'] + result['misses']
+    result['hit_rate'] = calls and float(result['hits']) / calls
+    return result
+
+
+def clear():
+    _approximants.clear()
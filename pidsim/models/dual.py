@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.dual
+    ~~~~~~~~~~~~~~~~~~
+
+    Dual numbers for the forward-mode differentiation of the model
+    coefficients.
+
+    A :class:`Dual` carries a value and its partial derivatives with
+    respect to a fixed list of variables. The ``coefficients`` methods of
+    the models only use the ``+``, ``-``, ``*`` and ``**`` operators (see
+    :mod:`pidsim.models.polynomial`), so calling them with dual arguments
+    gives the exact derivatives of every coefficient, for all the
+    variables in one evaluation.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['Dual', 'variables', 'value', 'derivatives']
+
+
+class Dual(object):
+    """Number ``value + sum(grad[i] * e_i)``, with ``e_i * e_j == 0``."""
+    
+    __slots__ = ('value', 'grad')
+    
+    def __init__(self, value, grad):
+        self.value = value
+        self.grad = tuple(grad)
+    
+    def __repr__(self):
+        return 'Dual(%r, %r)' % (self.value, self.grad)
+    
+    def _lift(self, other):
+        if isinstance(other, Dual):
+            return other
+        return Dual(other, (0,) * len(self.grad))
+    
+    def __add__(self, other):
+        other = self._lift(other)
+        return Dual(self.value + other.value,
+                    [a + b for a, b in zip(self.grad, other.grad)])
+    
+    __radd__ = __add__
+    
+    def __sub__(self, other):
+        other = self._lift(other)
+        return Dual(self.value - other.value,
+                    [a - b for a, b in zip(self.grad, other.grad)])
+    
+    def __rsub__(self, other):
+        return self._lift(other) - self
+    
+    def __neg__(self):
+        return Dual(-self.value, [-a for a in self.grad])
+    
+    def __pos__(self):
+        return self
+    
+    def __mul__(self, other):
+        other = self._lift(other)
+        return Dual(self.value * other.value,
+                    [a * other.value + self.value * b \
+                     for a, b in zip(self.grad, other.grad)])
+    
+    __rmul__ = __mul__
+    
+    def __truediv__(self, other):
+        other = self._lift(other)
+        quotient = self.value / other.value
+        return Dual(quotient, [(a - quotient * b) / other.value \
+                               for a, b in zip(self.grad, other.grad)])
+    
+    def __rtruediv__(self, other):
+        return self._lift(other) / self
+    
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+    
+    def __pow__(self, exponent):
+        if isinstance(exponent, Dual):
+            raise TypeError('Only constant exponents are supported.')
+        if exponent == 0:
+            return Dual(self.value ** 0, [0] * len(self.grad))
+        factor = exponent * self.value ** (exponent - 1)
+        return Dual(self.value ** exponent, [factor * a for a in self.grad])
+
+
+def variables(*values):
+    """Returns one :class:`Dual` for each of the values, seeded to
+    differentiate with respect to all of them, in order."""
+    size = len(values)
+    return [Dual(v, [1 if i == j else 0 for j in range(size)]) \
+            for i, v in enumerate(values)]
+
+
+def value(x):
+    """Returns the value of ``x``, dual or not."""
+    return x.value if isinstance(x, Dual) else x
+
+
+def derivatives(x, size):
+    """Returns the ``size`` partial derivatives of ``x``, all zero if it
+    isn't dual."""
+    return list(x.grad) if isinstance(x, Dual) else [0] * size
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.fitting
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Identification of recorded step responses against the reference model
+    catalogue. Requires NumPy.
+
+    Each candidate model is fitted by Levenberg-Marquardt least squares over
+    its continuous callback arguments, from several initial guesses, for
+    every combination of its integer arguments (``n``, ``pade_order``).
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['FitResult', 'INTEGER_CHOICES', 'least_squares', 'fit_model',
+           'fit_catalog']
+
+import itertools
+from collections import namedtuple
+
+import numpy
+
+from pidsim.models.models import index
+
+# values tried for the integer arguments of the models
+INTEGER_CHOICES = {
+    'n': (1, 2, 3, 4, 5, 6, 8),
+    'pade_order': (1, 2, 3),
+}
+
+FitResult = namedtuple('FitResult', 'model_id params residual rms')
+
+
+def least_squares(func, x0, max_iter=100, tol=1e-10):
+    """Minimizes ``sum(func(x) ** 2)`` with the Levenberg-Marquardt
+    method, from the initial guess ``x0``, using a forward difference
+    Jacobian. Returns the solution and its cost.
+    """
+    def cost_of(x):
+        try:
+            with numpy.errstate(all='ignore'):
+                r = numpy.asarray(func(x), dtype=float)
+                cost = numpy.dot(r, r)
+        except (ArithmeticError, ValueError, numpy.linalg.LinAlgError):
+            return None, numpy.inf
+        if not numpy.isfinite(cost):
+            return None, numpy.inf
+        return r, cost
+
+    x = numpy.array(x0, dtype=float)
+    r, cost = cost_of(x)
+    if r is None or not len(x):
+        return x, cost
+    damping = 1e-3
+    for iteration in range(max_iter):
+        J = numpy.empty((len(r), len(x)))
+        for i in range(len(x)):
+            h = 1e-7 * max(1.0, abs(x[i]))
+            shifted = x.copy()
+            shifted[i] += h
+            r_shifted = cost_of(shifted)[0]
+            if r_shifted is None:
+                return x, cost
+            J[:, i] = (r_shifted - r) / h
+        g = numpy.dot(J.T, r)
+        H = numpy.dot(J.T, J)
+        while True:
+            A = H + damping * numpy.diag(numpy.diag(H) + 1e-12)
+            try:
+                step = numpy.linalg.solve(A, -g)
+            except numpy.linalg.LinAlgError:
+                step = None
+            if step is not None:
+                r_new, cost_new = cost_of(x + step)
+                if cost_new < cost:
+                    break
+            damping *= 10
+            if damping > 1e12:
+                return x, cost
+        x = x + step
+        converged = cost - cost_new <= tol * max(cost, 1e-300)
+        r, cost = r_new, cost_new
+        damping = max(damping / 10, 1e-12)
+        if converged:
+            break
+    return x, cost
+
+
+def _initial_guesses(args, t, y, starts):
+    final = float(y[-1]) or 1.0
+    scale = float(t[-1] - t[0]) / 5 or 1.0
+    base = []
+    for arg in args:
+        if arg == 'k':
+            base.append(final)
+        elif arg in ('Omega',):
+            base.append(1.0 / scale)
+        elif arg in ('Zeta', 'Alpha'):
+            base.append(0.5)
+        else:
+            base.append(scale)
+    factors = numpy.logspace(-1, 1, starts) if starts > 1 else [1.0]
+    return [[value if arg == 'k' else value * factor \
+             for arg, value in zip(args, base)] for factor in factors]
+
+
+def fit_model(model_id, t, y, starts=3, guesses=None):
+    """Fits the model ``model_id`` of the index to the step response
+    ``y`` sampled at the times ``t``.
+
+    ``starts`` initial guesses are generated from the data, and the
+    optional ``guesses`` (a list of dicts of argument values) are tried as
+    well. Returns the best :class:`FitResult`.
+    """
+    t = numpy.asarray(t, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    model = index[model_id](None)
+    integer_args = model.integer_args
+    free = [arg for arg in model.args if arg not in integer_args]
+    initial = _initial_guesses(free, t, y, starts)
+    for guess in guesses or ():
+        initial.append([guess[arg] for arg in free])
+    best = None
+    choices = [INTEGER_CHOICES.get(arg, (1,)) for arg in integer_args]
+    for integers in itertools.product(*choices):
+        fixed = dict(zip(integer_args, integers))
+
+        def residual(x):
+            params = dict(fixed)
+            params.update(zip(free, x))
+            return model.analytic_step(t, **params) - y
+
+        for x0 in initial:
+            x, cost = least_squares(residual, x0)
+            if best is None or cost < best.residual:
+                params = dict(fixed)
+                params.update(zip(free, [float(value) for value in x]))
+                best = FitResult(model_id, params, float(cost),
+                                 float(numpy.sqrt(cost / len(y))))
+    return best
+
+
+def fit_catalog(t, y, model_ids=None, starts=3, workers=None):
+    """Fits every model of the index (or of ``model_ids``) to the step
+    response ``y`` sampled at ``t``.
+
+    This is a generator: as each model is fitted, it yields that model's
+    :class:`FitResult` and the list of all the results so far, ranked by
+    residual. With ``workers``, the models are fitted concurrently by a
+    ``concurrent.futures.ProcessPoolExecutor``, and results are yielded in
+    completion order.
+    """
+    if model_ids is None:
+        model_ids = sorted(index)
+    ranking = []
+
+    def ranked(result):
+        ranking.append(result)
+        ranking.sort(key=lambda result: result.residual)
+        return result, list(ranking)
+
+    if not workers:
+        for model_id in model_ids:
+            yield ranked(fit_model(model_id, t, y, starts))
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    executor = ProcessPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        for model_id in model_ids:
+            futures.append(executor.submit(fit_model, model_id, t, y, starts))
+        for future in as_completed(futures):
+            yield ranked(future.result())
+    finally:
+        # if the consumer stopped early, the models not started yet are
+        # not fitted in the background
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
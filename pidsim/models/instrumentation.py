@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.instrumentation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Opt-in instrumentation of the reference models.
+
+    When enabled, every ``callback`` call is reported to the registered
+    sinks with its model, parameters, latency and resulting system order,
+    and every lookup in the model and Padé caches is reported as a hit or a
+    miss. When disabled, the only cost is the check of :data:`enabled`.
+
+    Usage::
+
+        from pidsim.models import instrumentation
+        sink = instrumentation.MemorySink()
+        instrumentation.enable(sink)
+        ...
+        print(sink.summary())
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['CallEvent', 'Sink', 'MemorySink', 'LoggingSink',
+           'PrometheusTextFileSink', 'enable', 'disable', 'record_call',
+           'record_cache']
+
+import atexit
+import logging
+import os
+import tempfile
+import threading
+from collections import deque, namedtuple
+
+# checked on every hot path call, so keep it a plain module attribute
+enabled = False
+
+_sinks = []
+
+CallEvent = namedtuple('CallEvent', 'model params seconds order')
+
+
+def enable(*sinks):
+    """Registers the given sinks and turns the instrumentation on."""
+    global enabled
+    for sink in sinks:
+        if sink not in _sinks:
+            _sinks.append(sink)
+    enabled = bool(_sinks)
+
+
+def disable(*sinks):
+    """Unregisters and flushes the given sinks, or all of them if none is
+    given. The instrumentation is turned off when no sink is left.
+    """
+    global enabled
+    if sinks:
+        removed = [sink for sink in sinks if sink in _sinks]
+        for sink in removed:
+            _sinks.remove(sink)
+    else:
+        removed = list(_sinks)
+        del _sinks[:]
+    enabled = bool(_sinks)
+    for sink in removed:
+        # the sinks don't have to derive from Sink
+        flush = getattr(sink, 'flush', None)
+        if flush is not None:
+            flush()
+
+
+def record_call(model, params, seconds, order):
+    event = CallEvent(model, params, seconds, order)
+    for sink in _sinks:
+        sink.call(event)
+
+
+def record_cache(name, hit):
+    for sink in _sinks:
+        sink.cache(name, hit)
+
+
+class Sink(object):
+    """Base class of the instrumentation sinks."""
+    
+    def call(self, event):
+        pass
+    
+    def cache(self, name, hit):
+        pass
+    
+    def flush(self):
+        pass
+
+
+class _CallStats(object):
+    
+    def __init__(self, window):
+        self.count = 0
+        self.seconds = 0.0
+        self.latencies = deque(maxlen=window)
+        self.orders = {}
+
+
+class MemorySink(Sink):
+    """Aggregates the events in memory.
+
+    Calls are grouped by model name, or by ``key(event)`` if given (e.g.
+    ``lambda event: (event.model, event.params)``). Percentiles are
+    computed over the last ``window`` latencies of each group.
+    """
+    
+    def __init__(self, key=None, window=1000):
+        self.key = key or (lambda event: event.model)
+        self.window = window
+        self._calls = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+    
+    def call(self, event):
+        key = self.key(event)
+        with self._lock:
+            stats = self._calls.get(key)
+            if stats is None:
+                stats = self._calls[key] = _CallStats(self.window)
+            stats.count += 1
+            stats.seconds += event.seconds
+            stats.latencies.append(event.seconds)
+            stats.orders[event.order] = stats.orders.get(event.order, 0) + 1
+    
+    def cache(self, name, hit):
+        with self._lock:
+            counters = self._caches.setdefault(name, [0, 0])
+            counters[0 if hit else 1] += 1
+    
+    def percentile(self, key, q):
+        """Returns the ``q`` (0 to 100) percentile of the latency of the
+        ``key`` group, in seconds."""
+        with self._lock:
+            latencies = sorted(self._calls[key].latencies)
+        if not latencies:
+            return None
+        position = int(round((len(latencies) - 1) * q / 100.0))
+        return latencies[position]
+    
+    def summary(self, percentiles=(50, 90, 99)):
+        """Returns a dict with the aggregated call and cache statistics."""
+        calls = {}
+        with self._lock:
+            items = list(self._calls.items())
+            caches = dict((name, {'hits': hits, 'misses': misses}) \
+                for name, (hits, misses) in self._caches.items())
+        for key, stats in items:
+            calls[key] = {
+                'count': stats.count,
+                'seconds': stats.seconds,
+                'orders': dict(stats.orders),
+                'percentiles': dict((q, self.percentile(key, q)) \
+                    for q in percentiles),
+            }
+        return {'calls': calls, 'caches': caches}
+    
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._caches.clear()
+
+
+class LoggingSink(Sink):
+    """Logs every event, by default to the ``pidsim.models`` logger at
+    the DEBUG level."""
+    
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('pidsim.models')
+        self.level = level
+    
+    def call(self, event):
+        self.logger.log(self.level, '%s%r: %.3gs, order %s', event.model,
+                        event.params, event.seconds, event.order)
+    
+    def cache(self, name, hit):
+        self.logger.log(self.level, 'cache %s: %s', name,
+                        hit and 'hit' or 'miss')
+
+
+class PrometheusTextFileSink(MemorySink):
+    """Aggregates the events like :class:`MemorySink` and writes them to
+    ``path`` in the Prometheus text exposition format (e.g. for the node
+    exporter textfile collector), and on :meth:`write`. The file is
+    replaced atomically. Every ``every`` events, a background thread is
+    woken up to write it, so the models never wait for the file system.
+    The events after the last write are written by :meth:`flush`, on
+    :func:`disable` and at exit.
+    """
+    
+    def __init__(self, path, every=1000, window=1000):
+        MemorySink.__init__(self, window=window)
+        self.path = path
+        self.every = every
+        self._events = 0
+        self._written = 0
+        self._pending = threading.Event()
+        self._writer = None
+        self._pid = None
+        atexit.register(self.flush)
+    
+    def call(self, event):
+        MemorySink.call(self, event)
+        self._tick()
+    
+    def cache(self, name, hit):
+        MemorySink.cache(self, name, hit)
+        self._tick()
+    
+    def _tick(self):
+        with self._lock:
+            self._events += 1
+            due = self.every and self._events % self.every == 0
+        if due:
+            # threads don't cross a fork, so each process starts its own
+            if self._pid != os.getpid():
+                self._start_writer()
+            self._pending.set()
+    
+    def _start_writer(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pending = threading.Event()
+                self._writer = threading.Thread(target=self._run,
+                                                name='pidsim-prometheus')
+                self._writer.daemon = True
+                self._writer.start()
+                self._pid = os.getpid()
+    
+    def _run(self):
+        pending = self._pending
+        while True:
+            pending.wait()
+            pending.clear()
+            self.flush()
+    
+    def flush(self):
+        """Writes the file if there were events since the last write. Errors
+        are logged, not raised.
+        """
+        with self._lock:
+            if self._written == self._events:
+                return
+        try:
+            self.write()
+        except Exception:
+            logging.getLogger('pidsim.models').exception(
+                'Could not write the metrics to %s', self.path)
+    
+    def write(self):
+        with self._lock:
+            self._written = self._events
+        summary = self.summary(percentiles=(50, 90, 99))
+        lines = []
+        metric = lines.append
+        metric('# TYPE pidsim_model_callback_calls_total counter')
+        for model, stats in sorted(summary['calls'].items()):
+            metric('pidsim_model_callback_calls_total{model="%s"} %d' % \
+                (model, stats['count']))
+        metric('# TYPE pidsim_model_callback_seconds summary')
+        for model, stats in sorted(summary['calls'].items()):
+            for q, value in sorted(stats['percentiles'].items()):
+                metric('pidsim_model_callback_seconds{model="%s",'
+                       'quantile="%g"} %.9g' % (model, q / 100.0, value))
+            metric('pidsim_model_callback_seconds_sum{model="%s"} %.9g' % \
+                (model, stats['seconds']))
+            metric('pidsim_model_callback_seconds_count{model="%s"} %d' % \
+                (model, stats['count']))
+        metric('# TYPE pidsim_model_order_calls_total counter')
+        for model, stats in sorted(summary['calls'].items()):
+            for order, count in sorted(stats['orders'].items()):
+                metric('pidsim_model_order_calls_total{model="%s",'
+                       'order="%s"} %d' % (model, order, count))
+        for kind in ('hits', 'misses'):
+            metric('# TYPE pidsim_cache_%s_total counter' % kind)
+            for name, counters in sorted(summary['caches'].items()):
+                metric('pidsim_cache_%s_total{cache="%s"} %d' % \
+                    (kind, name, counters[kind]))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.pidsim-')
+        with os.fdopen(fd, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        os.rename(tmp, self.path)
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.lti
+    ~~~~~~~~~~~~~~~~~
+
+    State-space realizations and discrete-time simulation of the reference
+    models. Requires NumPy.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['state_space', 'expm', 'zoh', 'tustin', 'difference_equation',
+           'zpk_response', 'zpk_to_sos', 'sos_state_space',
+           'sensitivity_state_space', 'lyapunov', 'ReducedSystem',
+           'balanced_truncation', 'DiscreteSystem']
+
+from collections import namedtuple
+
+import numpy
+
+ReducedSystem = namedtuple('ReducedSystem', 'A B C D bound hankel')
+
+
+def _readonly(*arrays):
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+
+def state_space(num, den):
+    """Returns the (A, B, C, D) matrices of the controllable canonical
+    realization of ``num(s) / den(s)``, as read-only contiguous arrays.
+    """
+    num = numpy.trim_zeros(numpy.atleast_1d(numpy.asarray(num, dtype=float)),
+                           'f')
+    den = numpy.trim_zeros(numpy.atleast_1d(numpy.asarray(den, dtype=float)),
+                           'f')
+    if len(den) == 0:
+        raise ValueError('The denominator must not be zero.')
+    if len(num) > len(den):
+        raise ValueError('The transfer function must be proper.')
+    num = numpy.concatenate((numpy.zeros(len(den) - len(num)), num)) / den[0]
+    den = den / den[0]
+    order = len(den) - 1
+    A = numpy.zeros((order, order))
+    if order:
+        A[0, :] = -den[1:]
+        A[1:, :-1] = numpy.eye(order - 1)
+    B = numpy.zeros((order, 1))
+    if order:
+        B[0, 0] = 1.0
+    C = (num[1:] - num[0] * den[1:]).reshape(1, order)
+    D = numpy.array([[num[0]]])
+    return _readonly(A, B, numpy.ascontiguousarray(C), D)
+
+
+def expm(M):
+    """Returns the matrix exponential of ``M``, using scaling and squaring
+    with a degree 6 Padé approximant. ``M`` may also be a stack of
+    matrices, with shape (k, n, n), all scaled by the largest norm.
+    """
+    M = numpy.asarray(M, dtype=float)
+    norm = numpy.abs(M).sum(axis=-1).max() if M.size else 0.0
+    squarings = max(0, int(numpy.ceil(numpy.log2(norm))) + 1) if norm else 0
+    X = M / 2.0 ** squarings
+    identity = numpy.broadcast_to(numpy.eye(M.shape[-1]), M.shape)
+    num = identity.copy()
+    den = identity.copy()
+    term = identity
+    c = 1.0
+    q = 6
+    for k in range(1, q + 1):
+        c = c * (q - k + 1) / (k * (2 * q - k + 1))
+        term = numpy.matmul(X, term)
+        num += c * term
+        den += (-1) ** k * c * term
+    E = numpy.linalg.solve(den, num)
+    for i in range(squarings):
+        E = numpy.matmul(E, E)
+    return E
+
+
+def zoh(A, B, Ts):
+    """Returns the (Ad, Bd) matrices of the zero-order hold discretization
+    of ``dx/dt = A x + B u`` with sample time ``Ts``.
+    """
+    A = numpy.asarray(A, dtype=float)
+    B = numpy.asarray(B, dtype=float)
+    n, m = B.shape
+    M = numpy.zeros((n + m, n + m))
+    M[:n, :n] = A
+    M[:n, n:] = B
+    E = expm(M * Ts)
+    return _readonly(numpy.ascontiguousarray(E[:n, :n]),
+                     numpy.ascontiguousarray(E[:n, n:]))
+
+
+def tustin(num, den, Ts):
+    """Returns the numerator and denominator, in descending powers of z, of
+    the bilinear (Tustin) transform of ``num(s) / den(s)``.
+    """
+    num = numpy.trim_zeros(numpy.atleast_1d(numpy.asarray(num, dtype=float)),
+                           'f')
+    den = numpy.trim_zeros(numpy.atleast_1d(numpy.asarray(den, dtype=float)),
+                           'f')
+    order = len(den) - 1
+    if len(num) > len(den):
+        raise ValueError('The transfer function must be proper.')
+    num = numpy.concatenate((numpy.zeros(len(den) - len(num)), num))
+    # s = (2 / Ts) (z - 1) / (z + 1), multiplied through by (z + 1)^order
+    terms = []
+    for power in range(order, -1, -1):
+        term = numpy.ones(1)
+        for i in range(power):
+            term = numpy.polymul(term, [1.0, -1.0])
+        for i in range(order - power):
+            term = numpy.polymul(term, [1.0, 1.0])
+        terms.append(term * (2.0 / Ts) ** power)
+    return (sum(c * term for c, term in zip(num, terms)),
+            sum(c * term for c, term in zip(den, terms)))
+
+
+def difference_equation(num, den, Ts, method='zoh', delay=0):
+    """Discretizes ``num(s) / den(s)`` with sample time ``Ts``, using a
+    zero-order hold (``zoh``) or the bilinear transform (``tustin``), and
+    returns the (b, a) coefficients of the difference equation
+
+        a[0] y[k] + a[1] y[k-1] + ... = b[0] u[k] + b[1] u[k-1] + ...
+
+    as read-only float64 arrays, normalized to ``a[0] == 1``. ``delay`` is
+    an integer number of samples of dead time, added as leading zeros of b.
+    """
+    if method == 'zoh':
+        A, B, C, D = state_space(num, den)
+        Ad, Bd = zoh(A, B, Ts)
+        # C adj(zI - Ad) Bd = det(zI - Ad + Bd C) - det(zI - Ad)
+        a = numpy.poly(Ad) if len(Ad) else numpy.ones(1)
+        b = (numpy.poly(Ad - numpy.dot(Bd, C)) if len(Ad) else numpy.ones(1))
+        b = b + (D[0, 0] - 1) * a
+    elif method == 'tustin':
+        b, a = tustin(num, den, Ts)
+    else:
+        raise ValueError('Unknown discretization method: %s' % method)
+    b = numpy.concatenate((numpy.zeros(int(delay)), b / a[0]))
+    a = a / a[0]
+    return _readonly(numpy.ascontiguousarray(b, dtype=numpy.float64),
+                     numpy.ascontiguousarray(a, dtype=numpy.float64))
+
+
+def zpk_response(zeros, poles, gain, s):
+    """Evaluates ``gain * prod(s - zeros) / prod(s - poles)`` over the
+    complex points ``s``, factor by factor.
+    """
+    s = numpy.asarray(s, dtype=complex)
+    response = numpy.full(s.shape, gain, dtype=complex)
+    for zero in zeros:
+        response *= s - zero
+    for pole in poles:
+        response /= s - pole
+    return response
+
+
+def _group_roots(roots):
+    # groups the roots in real polynomials of degree 2 (conjugate pairs or
+    # two real roots) and, if the count of real roots is odd, one of degree 1
+    roots = sorted(roots, key=lambda root: (abs(root), root.imag))
+    real = [root.real for root in roots if abs(root.imag) <= \
+            1e-9 * max(1.0, abs(root))]
+    groups = [numpy.real(numpy.poly([root, root.conjugate()])) \
+              for root in roots if root.imag > 1e-9 * max(1.0, abs(root))]
+    for i in range(0, len(real) - 1, 2):
+        groups.append(numpy.poly(real[i:i + 2]))
+    if len(real) % 2:
+        groups.append(numpy.poly(real[-1:]))
+    return groups
+
+
+def zpk_to_sos(zeros, poles, gain):
+    """Returns the zeros, poles and gain as a list of cascaded (num, den)
+    sections with real coefficients, each of them proper and of degree 2
+    or less. The gain is applied to the first section.
+    """
+    if len(zeros) > len(poles):
+        raise ValueError('The transfer function must be proper.')
+    num_groups = _group_roots(zeros)
+    den_groups = _group_roots(poles)
+    # the quadratic numerators go with the quadratic denominators
+    num_groups.sort(key=len, reverse=True)
+    den_groups.sort(key=len, reverse=True)
+    sections = []
+    for i, den in enumerate(den_groups):
+        num = num_groups[i] if i < len(num_groups) else numpy.ones(1)
+        sections.append((numpy.asarray(num, dtype=float),
+                         numpy.asarray(den, dtype=float)))
+    if not sections:
+        sections.append((numpy.ones(1), numpy.ones(1)))
+    num, den = sections[0]
+    sections[0] = (num * gain, den)
+    return sections
+
+
+def sos_state_space(sections):
+    """Returns the (A, B, C, D) matrices of the series connection of the
+    given (num, den) sections, each realized in controllable canonical
+    form. Keeping the factored structure avoids the wide coefficient
+    ranges of the expanded polynomials.
+    """
+    A, B, C, D = [numpy.array(m) for m in state_space(*sections[0])]
+    for num, den in sections[1:]:
+        A2, B2, C2, D2 = state_space(num, den)
+        n1, n2 = len(A), len(A2)
+        A_new = numpy.zeros((n1 + n2, n1 + n2))
+        A_new[:n1, :n1] = A
+        A_new[n1:, :n1] = numpy.dot(B2, C)
+        A_new[n1:, n1:] = A2
+        B = numpy.vstack((B, numpy.dot(B2, D)))
+        C = numpy.hstack((numpy.dot(D2, C), C2))
+        D = numpy.dot(D2, D)
+        A = A_new
+    return _readonly(numpy.ascontiguousarray(A), numpy.ascontiguousarray(B),
+                     numpy.ascontiguousarray(C), numpy.ascontiguousarray(D))
+
+
+def sensitivity_state_space(num, den, gradients):
+    """Returns the (A, B, C, D) matrices of a system whose outputs are the
+    output of ``num(s) / den(s)`` and its derivatives with respect to some
+    parameters, given as a list of (dnum, dden) coefficient derivatives.
+
+    Each derivative is the output of the parameter derivative of the
+    controllable canonical realization (see :func:`state_space`), driven by
+    its state. C and D have one row per output: the response first, then
+    one per parameter.
+    """
+    num = numpy.atleast_1d(numpy.asarray(num, dtype=float))
+    den = numpy.atleast_1d(numpy.asarray(den, dtype=float))
+    if len(num) > len(den):
+        raise ValueError('The transfer function must be proper.')
+    size = len(den)
+
+    def pad(coefs):
+        coefs = numpy.atleast_1d(numpy.asarray(coefs, dtype=float))
+        return numpy.concatenate((numpy.zeros(size - len(coefs)), coefs))
+
+    num = pad(num)
+    den = pad(den)
+    if den[0] == 0:
+        raise ValueError('The leading denominator coefficient must not be '
+                         'zero.')
+    a = den / den[0]
+    b = num / den[0]
+    A, B, C, D = state_space(b, a)
+    order = len(A)
+    count = len(gradients)
+    A_out = numpy.zeros((order * (count + 1), order * (count + 1)))
+    B_out = numpy.zeros((order * (count + 1), 1))
+    C_out = numpy.zeros((count + 1, order * (count + 1)))
+    D_out = numpy.zeros((count + 1, 1))
+    A_out[:order, :order] = A
+    B_out[:order] = B
+    C_out[0, :order] = C[0]
+    D_out[0, 0] = D[0, 0]
+    for i, (dnum, dden) in enumerate(gradients):
+        dnum = pad(dnum)
+        dden = pad(dden)
+        # derivatives of the normalized coefficients
+        da = (dden - a * dden[0]) / den[0]
+        db = (dnum - b * dden[0]) / den[0]
+        block = slice(order * (i + 1), order * (i + 2))
+        A_out[block, block] = A
+        if order:
+            A_out[order * (i + 1), :order] = -da[1:]
+        C_out[i + 1, :order] = db[1:] - db[0] * a[1:] - b[0] * da[1:]
+        C_out[i + 1, block] = C[0]
+        D_out[i + 1, 0] = db[0]
+    return _readonly(A_out, B_out, C_out, D_out)
+
+
+def lyapunov(A, Q, iterations=60):
+    """Returns the solution X of ``A X + X A^T + Q = 0``, for a stable A.
+
+    The equation is mapped by the Cayley transform ``Ad = (A - p I)^-1
+    (A + p I)`` to the discrete one ``X = Ad X Ad^T + Qd``, whose series
+    solution is summed by the squared Smith iteration, doubling the number
+    of terms at each step. That only needs O(n^3) products and solves, and
+    O(n^2) memory. The shift p is the geometric mean of the smallest and
+    largest pole magnitudes, and the iteration stops when the last terms
+    are negligible, raising a ``ValueError`` if that takes more than
+    ``iterations`` steps (poles too close to the imaginary axis).
+    """
+    A = numpy.asarray(A, dtype=float)
+    Q = numpy.asarray(Q, dtype=float)
+    n = len(A)
+    if not n:
+        return numpy.zeros((0, 0))
+    poles = numpy.linalg.eigvals(A)
+    if poles.real.max() >= 0:
+        raise ValueError('The Lyapunov equation requires a stable system.')
+    magnitudes = numpy.abs(poles)
+    p = numpy.sqrt(magnitudes.min() * magnitudes.max())
+    M = A - p * numpy.eye(n)
+    Ad = numpy.linalg.solve(M, A + p * numpy.eye(n))
+    Mi_Q = numpy.linalg.solve(M, Q)
+    X = 2 * p * numpy.linalg.solve(M, Mi_Q.T).T
+    for i in range(iterations):
+        term = numpy.dot(numpy.dot(Ad, X), Ad.T)
+        X = X + term
+        if numpy.abs(term).max() <= 1e-15 * numpy.abs(X).max():
+            return (X + X.T) / 2
+        Ad = numpy.dot(Ad, Ad)
+    raise ValueError('The Lyapunov equation did not converge in %d '
+                     'iterations.' % iterations)
+
+
+def _psd_factor(X):
+    # L with L L^T == X, for a symmetric positive semi-definite X
+    values, vectors = numpy.linalg.eigh(X)
+    return vectors * numpy.sqrt(numpy.maximum(values, 0))
+
+
+def balanced_truncation(A, B, C, D, tolerance=None, order=None):
+    """Reduces the stable system (A, B, C, D) by balanced truncation,
+    with the square root method.
+
+    The kept order is ``order`` if given, otherwise the smallest one whose
+    error bound is within ``tolerance`` (by default, the one that only
+    drops the numerically zero Hankel singular values). Returns a
+    :class:`ReducedSystem` with the read-only matrices, the bound
+    ``2 * sum(dropped Hankel singular values)`` of the peak frequency
+    response error, and all the Hankel singular values.
+    """
+    A = numpy.asarray(A, dtype=float)
+    B = numpy.asarray(B, dtype=float)
+    C = numpy.asarray(C, dtype=float)
+    D = numpy.asarray(D, dtype=float)
+    if len(A) and numpy.linalg.eigvals(A).real.max() >= 0:
+        raise ValueError('Balanced truncation requires a stable system.')
+    Lc = _psd_factor(lyapunov(A, numpy.dot(B, B.T)))
+    Lo = _psd_factor(lyapunov(A.T, numpy.dot(C.T, C)))
+    W, hankel, Vt = numpy.linalg.svd(numpy.dot(Lo.T, Lc))
+    # tails[r] is the error bound of keeping r states
+    tails = 2 * numpy.concatenate((numpy.cumsum(hankel[::-1])[::-1], [0.0]))
+    nonzero = int((hankel > hankel[0] * 1e-12).sum()) if len(hankel) else 0
+    if order is None:
+        if tolerance is None:
+            order = nonzero
+        else:
+            order = int(numpy.nonzero(tails <= tolerance)[0][0])
+    order = min(int(order), nonzero)
+    scale = 1 / numpy.sqrt(hankel[:order])
+    T = numpy.dot(Lc, Vt[:order].T) * scale
+    Ti = scale[:, numpy.newaxis] * numpy.dot(W[:, :order].T, Lo.T)
+    return ReducedSystem(*_readonly(
+        numpy.ascontiguousarray(numpy.dot(Ti, numpy.dot(A, T))),
+        numpy.ascontiguousarray(numpy.dot(Ti, B)),
+        numpy.ascontiguousarray(numpy.dot(C, T)),
+        numpy.array(D)) + (float(tails[order]), hankel))
+
+
+class DiscreteSystem(object):
+    """Single-input single-output discrete-time state-space system.
+
+    The state and the work buffers are allocated once, so ``step`` and
+    ``simulate`` don't create objects per sample.
+    """
+    
+    def __init__(self, A, B, C, D, Ts):
+        self.A = A
+        self.B = B
+        self.C = C
+        self.D = D
+        self.Ts = Ts
+        self.order = len(A)
+        self._b = numpy.ascontiguousarray(B[:, 0])
+        self._c = numpy.ascontiguousarray(C[0, :])
+        self._d = float(D[0, 0])
+        self.x = numpy.zeros(self.order)
+        self._ax = numpy.zeros(self.order)
+        self._bu = numpy.zeros(self.order)
+    
+    def reset(self):
+        self.x.fill(0.0)
+    
+    def step(self, u):
+        """Advances one sample with input ``u`` and returns the output."""
+        y = numpy.dot(self._c, self.x) + self._d * u
+        numpy.dot(self.A, self.x, out=self._ax)
+        numpy.multiply(self._b, u, out=self._bu)
+        numpy.add(self._ax, self._bu, out=self.x)
+        return y
+    
+    def simulate(self, u, out=None):
+        """Runs the system over the input sequence ``u``, writing the
+        outputs to ``out`` (allocated if not given), and returns it.
+        """
+        u = numpy.ascontiguousarray(u, dtype=float).ravel()
+        if out is None:
+            out = numpy.empty(len(u))
+        A, b, c, d = self.A, self._b, self._c, self._d
+        x, ax, bu = self.x, self._ax, self._bu
+        for i in range(len(u)):
+            out[i] = numpy.dot(c, x) + d * u[i]
+            numpy.dot(A, x, out=ax)
+            numpy.multiply(b, u[i], out=bu)
+            numpy.add(ax, bu, out=x)
+        return out
+    
+    def step_response(self, samples):
+        """Returns the unit step response, from a zero state."""
+        self.reset()
+        return self.simulate(numpy.ones(samples))
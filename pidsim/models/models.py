@@ -9,9 +9,23 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
-from pidsim.core.pade import index as pade_index
-from pidsim.core.types import tf, poly
-from pidsim.models.base import ReferenceModel, I18nStr
+from pidsim.models import delay
+from pidsim.models.base import ReferenceModel, I18nStr, Parameter, tf, poly
+from pidsim.models.polynomial import binomial, polyadd, polymul, pade
+
+# tf and poly are lazy: pidsim.core is only imported by the first callback,
+# so the model metadata (name, description, transfer_function and args) is
+# cheap to load.
+
+
+def _exp_difference(a, b):
+    # (exp(-a) - exp(-b)) / (b - a), without the cancellation of a ~ b
+    from numpy import absolute, errstate, exp, expm1, minimum, where
+    x = absolute(b - a)
+    with errstate(divide='ignore', invalid='ignore'):
+        ratio = where(x == 0, 1.0, -expm1(-x) / x)
+    return exp(-minimum(a, b)) * ratio
+
 
 class Model1(ReferenceModel):
     
@@ -28,10 +42,27 @@ Os parâmetros do processo são o ganho estático (k) e a constante de tempo
 The model parameters are the static gain (k) and the time constant (Tau)'''),
     ])
     
+    parameters = {
+        'Tau': Parameter(minimum=0, exclusive=True),
+    }
+    
+    # cheaper to build than to look up
+    callback_cache_size = 0
+    
     transfer_function = 'G_p(s) = \\frac{k}{(1+\\tau s)}'
     
     def callback(self, k, Tau):
         return tf([k], [Tau, 1])
+    
+    def coefficients(self, k, Tau):
+        return [k], [Tau, 1]
+    
+    def zpk(self, k, Tau):
+        return [], [-1.0 / Tau], 1.0 * k / Tau
+    
+    def step_formula(self, t, k, Tau):
+        from numpy import exp
+        return k * (1 - exp(-t / Tau))
 
 
 class Model2(ReferenceModel):
@@ -48,10 +79,31 @@ Os parâmetros do processo são o ganho estático (k) e os tempos T1 e T2.'''),
 The model parameters are the static gain (k) and the times T1 and T2.'''),
     ])
     
+    parameters = {
+        'T1': Parameter(minimum=0, exclusive=True),
+        'T2': Parameter(minimum=0, exclusive=True),
+    }
+    
+    # cheaper to build than to look up
+    callback_cache_size = 0
+    
     transfer_function = 'G_p(s) = \\frac{k}{(1+T_1 s)(1+T_2 s)}'
     
     def callback(self, k, T1, T2):
         return tf([k], poly([T1, 1]) * poly([T2, 1]))
+    
+    def coefficients(self, k, T1, T2):
+        return [k], polymul([T1, 1], [T2, 1])
+    
+    def zpk(self, k, T1, T2):
+        return [], [-1.0 / T1, -1.0 / T2], 1.0 * k / (T1 * T2)
+    
+    def step_formula(self, t, k, T1, T2):
+        # the (T1 exp(-t/T1) - T2 exp(-t/T2)) / (T1 - T2) term, written
+        # to stay accurate when T1 ~ T2 (and be (1 + t/T1) exp(-t/T1) there)
+        from numpy import exp
+        difference = _exp_difference(t / T1, t / T2)
+        return k * (1 - exp(-t / T2) - t / T2 * difference)
 
 
 class Model3(ReferenceModel):
@@ -68,10 +120,32 @@ Os parâmetros do processo são o ganho estático (k) e os tempos T1 e T2.'''),
 The model parameters are the static gain (k) and the times T1 and T2.'''),
     ])
     
+    parameters = {
+        'T1': Parameter(minimum=0, exclusive=True),
+        'T2': Parameter(minimum=0, exclusive=True),
+    }
+    
+    # cheaper to build than to look up
+    callback_cache_size = 0
+    
     transfer_function = 'G_p(s) = \\frac{k(1-T_1 s)}{(1+T_1 s)(1+T_2 s)}'
     
     def callback(self, k, T1, T2):
         return tf([-T1 * k, k], poly([T1, 1]) * poly([T2, 1]))
+    
+    def coefficients(self, k, T1, T2):
+        return [-T1 * k, k], polymul([T1, 1], [T2, 1])
+    
+    def zpk(self, k, T1, T2):
+        return [1.0 / T1], [-1.0 / T1, -1.0 / T2], -1.0 * k / T2
+    
+    def step_formula(self, t, k, T1, T2):
+        # the (-2 T1 exp(-t/T1) + (T1 + T2) exp(-t/T2)) / (T1 - T2) term,
+        # written to stay accurate when T1 ~ T2
+        from numpy import exp
+        difference = _exp_difference(t / T1, t / T2)
+        return k * (1 - exp(-t / T1) -
+                    (T1 + T2) * t / (T1 * T2) * difference)
 
 
 class Model4(ReferenceModel):
@@ -92,12 +166,44 @@ the dead time (Tt) and the Padé approximant order, used to simulate the
 dead time.'''),
     ])
     
+    parameters = {
+        'T1': Parameter(minimum=0, exclusive=True),
+        'T2': Parameter(minimum=0, exclusive=True),
+        'T3': Parameter(minimum=0, exclusive=True),
+        'T4': Parameter(minimum=0),
+        'Tt': Parameter(minimum=0),
+        'pade_order': Parameter(int, minimum=1, choices=delay.orders),
+    }
+    
     transfer_function = 'G_p(s) = \\frac{k(1+T_4 s)}{(1+T_1 s)(1+T_2 s)(1+T_3 s)} e^{-T_t s}'
     
     def callback(self, k, T1, T2, T3, T4, Tt, pade_order):
         num = poly([k * T4, k])
         den = poly([T1, 1]) * poly([T2, 1]) * poly([T3, 1])
-        return tf(num, den) * pade_index[int(pade_order)](Tt)
+        return tf(num, den) * delay.approximant(pade_order, Tt)
+    
+    def coefficients(self, k, T1, T2, T3, T4, Tt, pade_order):
+        pade_num, pade_den = pade(pade_order, Tt)
+        num = polymul([k * T4, k], pade_num)
+        den = polymul([T1, 1], [T2, 1], [T3, 1], pade_den)
+        return num, den
+    
+    def zpk(self, k, T1, T2, T3, T4, Tt, pade_order):
+        zeros, poles, gain = delay.pade_zpk(pade_order, Tt)
+        poles = [-1.0 / T1, -1.0 / T2, -1.0 / T3] + poles
+        gain = gain * k / (1.0 * T1 * T2 * T3)
+        if getattr(T4, 'ndim', 0):
+            # arrays, from metrics_batch: no zero where T4 is zero
+            from numpy import errstate, nan, where
+            with errstate(divide='ignore'):
+                zero = where(T4 == 0, nan, -1.0 / T4)
+            return [zero] + zeros, poles, gain * where(T4 == 0, 1, T4)
+        if T4 == 0:
+            return zeros, poles, gain
+        return [-1.0 / T4] + zeros, poles, gain * T4
+    
+    def dead_time(self, k, T1, T2, T3, T4, Tt, pade_order):
+        return Tt
 
 
 class Model5(ReferenceModel):
@@ -116,13 +222,23 @@ The unique parameter of the model is its order (n). The suggested values
 for n are: 1, 2, 3, 4 and 8.'''),
     ])
     
+    parameters = {
+        'n': Parameter(int, minimum=1, suggested=(1, 2, 3, 4, 8)),
+    }
+    
+    # cheaper to build than to look up
+    callback_cache_size = 0
+    
     transfer_function = 'G_p(s) = \\frac{1}{(s+1)^n}'
     
     def callback(self, n):
-        a = poly([1, 1])
-        for i in range(1, int(n)):
-            a = a * poly([1, 1])
-        return tf([1], list(a))
+        return tf([1], binomial(max(int(n), 1)))
+    
+    def coefficients(self, n):
+        return [1], binomial(max(int(n), 1))
+    
+    def zpk(self, n):
+        return [], [-1.0] * max(int(n), 1), 1.0
 
 
 class Model6(ReferenceModel):
@@ -141,12 +257,29 @@ The unique parameter of the model is Alpha. The suggested values for
 Alpha are: 0.1, 0.2, 0.5 and 1.'''),
     ])
     
+    parameters = {
+        'Alpha': Parameter(minimum=0, exclusive=True,
+                           suggested=(0.1, 0.2, 0.5, 1)),
+    }
+    
+    # cheaper to build than to look up
+    callback_cache_size = 0
+    
     transfer_function = 'G_p(s) = \\frac{1}{(s+1)(\\alpha s+1)(\\alpha ^2 s+1)(\\alpha ^3 s+1)}'
     
     def callback(self, Alpha):
         num = (poly([1, 1]) * poly([Alpha, 1])) * (poly([Alpha * Alpha, 1]) * \
             poly([Alpha * Alpha * Alpha, 1]))
         return tf([1], num)
+    
+    def coefficients(self, Alpha):
+        return [1], polymul([1, 1], [Alpha, 1], [Alpha * Alpha, 1],
+                            [Alpha * Alpha * Alpha, 1])
+    
+    def zpk(self, Alpha):
+        Alpha = 1.0 * Alpha
+        poles = [-1.0, -1 / Alpha, -1 / Alpha ** 2, -1 / Alpha ** 3]
+        return [], poles, 1 / Alpha ** 6
 
 
 class Model7(ReferenceModel):
@@ -165,10 +298,24 @@ The unique parameter of the model is Alpha. The suggested values for
 Alpha are: 0.1, 0.2, 0.5, 1, 2 and 5.'''),
     ])
     
+    parameters = {
+        'Alpha': Parameter(minimum=0, exclusive=True,
+                           suggested=(0.1, 0.2, 0.5, 1, 2, 5)),
+    }
+    
+    # cheaper to build than to look up
+    callback_cache_size = 0
+    
     transfer_function = 'G_p(s) = \\frac{1-\\alpha s}{(s+1)^3}'
     
     def callback(self, Alpha):
-        return tf([-Alpha, 1], (poly([1, 1]) * poly([1, 1])) * poly([1, 1]))
+        return tf([-Alpha, 1], binomial(3))
+    
+    def coefficients(self, Alpha):
+        return [-Alpha, 1], binomial(3)
+    
+    def zpk(self, Alpha):
+        return [1.0 / Alpha], [-1.0] * 3, -1.0 * Alpha
 
 
 class Model8(ReferenceModel):
@@ -187,10 +334,26 @@ The model parameters are the time constant (Tau) and the Padé approximant
 order, used to simulate the dead time.'''),
     ])
     
+    parameters = {
+        'Tau': Parameter(minimum=0, exclusive=True),
+        'pade_order': Parameter(int, minimum=1, choices=delay.orders),
+    }
+    
     transfer_function = 'G_p(s) = \\frac{1}{(\\tau s +1)}e^{-s}'
     
     def callback(self, Tau, pade_order):
-        return tf([1], [Tau, 1]) * pade_index[int(pade_order)](1)
+        return tf([1], [Tau, 1]) * delay.approximant(pade_order, 1)
+    
+    def coefficients(self, Tau, pade_order):
+        pade_num, pade_den = pade(pade_order, 1)
+        return pade_num, polymul([Tau, 1], pade_den)
+    
+    def zpk(self, Tau, pade_order):
+        zeros, poles, gain = delay.pade_zpk(pade_order, 1)
+        return zeros, [-1.0 / Tau] + poles, gain / (1.0 * Tau)
+    
+    def dead_time(self, Tau, pade_order):
+        return 1
 
 
 class Model9(ReferenceModel):
@@ -209,11 +372,26 @@ The model parameters are the time constant (Tau) and the Padé approximant
 order, used to simulate the dead time.'''),
     ])
     
+    parameters = {
+        'Tau': Parameter(minimum=0, exclusive=True),
+        'pade_order': Parameter(int, minimum=1, choices=delay.orders),
+    }
+    
     transfer_function = 'G_p(s) = \\frac{1}{(\\tau s +1)^2}e^{-s}'
     
     def callback(self, Tau, pade_order):
-        return tf([1], poly([Tau, 1]) * poly([Tau, 1])) * \
-            pade_index[int(pade_order)](1)
+        return tf([1], binomial(2, Tau)) * delay.approximant(pade_order, 1)
+    
+    def coefficients(self, Tau, pade_order):
+        pade_num, pade_den = pade(pade_order, 1)
+        return pade_num, polymul(binomial(2, Tau), pade_den)
+    
+    def zpk(self, Tau, pade_order):
+        zeros, poles, gain = delay.pade_zpk(pade_order, 1)
+        return zeros, [-1.0 / Tau] * 2 + poles, gain / (1.0 * Tau * Tau)
+    
+    def dead_time(self, Tau, pade_order):
+        return 1
 
 
 class Model10(ReferenceModel):
@@ -235,6 +413,14 @@ class Model10(ReferenceModel):
         p2 = tf([1], [1, 1])
         p3 = tf([0.5], [1, 0.05])
         return p1 * (p2 + p3)
+    
+    def coefficients(self):
+        num = polymul([100], polyadd([1, 0.05], polymul([0.5], [1, 1])))
+        den = polymul([1, 10], [1, 10], [1, 1], [1, 0.05])
+        return num, den
+    
+    def zpk(self):
+        return [-0.55 / 1.5], [-10.0, -10.0, -1.0, -0.05], 150.0
 
 
 class Model11(ReferenceModel):
@@ -254,6 +440,14 @@ class Model11(ReferenceModel):
     def callback(self):
         den = (poly([1, 0]) * poly([1, 1])) * (poly([1, 1]) * poly([1, 36]))
         return tf(poly([1, 6]) * poly([1, 6]), den)
+    
+    def coefficients(self):
+        num = polymul([1, 6], [1, 6])
+        den = polymul([1, 0], [1, 1], [1, 1], [1, 36])
+        return num, den
+    
+    def zpk(self):
+        return [-6.0, -6.0], [0.0, -1.0, -1.0, -36.0], 1.0
 
 
 class Model12(ReferenceModel):
@@ -272,10 +466,43 @@ The model parameters are Omega and Zeta. The suggested value for Zeta
 is 0.1 and the suggested values for Omega are 1, 2, 5 and 10.'''),
     ])
     
+    parameters = {
+        'Omega': Parameter(minimum=0, exclusive=True,
+                           suggested=(1, 2, 5, 10)),
+        'Zeta': Parameter(minimum=0, suggested=(0.1,)),
+    }
+    
     transfer_function = 'G_p(s) = \\frac{\\omega _0^2}{(s+1)(s^2+2\\zeta \\omega _0 s+\\omega _0^2)}'
     
     def callback(self, Omega, Zeta):
         return tf([Omega * Omega], poly([1, 1]) * poly([1, 2 * Zeta * Omega, Omega * Omega]))
+    
+    def coefficients(self, Omega, Zeta):
+        return [Omega * Omega], polymul([1, 1],
+                                        [1, 2 * Zeta * Omega, Omega * Omega])
+    
+    def zpk(self, Omega, Zeta):
+        from numpy.lib.scimath import sqrt
+        root = sqrt(Zeta * Zeta - 1)
+        poles = [-1.0, Omega * (-Zeta + root), Omega * (-Zeta - root)]
+        return [], poles, 1.0 * Omega * Omega
+    
+    def step_formula(self, t, Omega, Zeta):
+        from numpy import exp, lib
+        # sum of the residues of G(s)/s at the poles -1 and
+        # -Zeta Omega +- j Omega sqrt(1 - Zeta^2)
+        root = lib.scimath.sqrt(Zeta * Zeta - 1)
+        poles = [-1, Omega * (-Zeta + root), Omega * (-Zeta - root)]
+        y = 1
+        for i, pole in enumerate(poles):
+            den = pole
+            for j, other in enumerate(poles):
+                if i != j:
+                    den = den * (pole - other)
+            if den == 0:
+                return None  # repeated poles
+            y = y + Omega * Omega / den * exp(pole * t)
+        return y.real
 
 
 class Model13(ReferenceModel):
@@ -290,10 +517,23 @@ class Model13(ReferenceModel):
         ('en_US', u'This model does not allow parameterization.'),
     ])
     
+    # cheaper to build than to look up
+    callback_cache_size = 0
+    
     transfer_function = 'G_p(s) = \\frac{1}{s^2 - 1}'
     
     def callback(self):
         return tf([1], [1, 0, -1])
+    
+    def coefficients(self):
+        return [1], [1, 0, -1]
+    
+    def zpk(self):
+        return [], [1.0, -1.0], 1.0
+    
+    def step_formula(self, t):
+        from numpy import cosh
+        return cosh(t) - 1
 
 
 class Model14(ReferenceModel):
@@ -312,10 +552,26 @@ The model parameters are the time constant (Tau) and the Padé approximant
 order, used to simulate the dead time.'''),
     ])
     
+    parameters = {
+        'Tau': Parameter(minimum=0, exclusive=True),
+        'pade_order': Parameter(int, minimum=1, choices=delay.orders),
+    }
+    
     transfer_function = 'G_p(s) = \\frac{1}{s(\\tau s + 1)}e^{-s}'
     
     def callback(self, Tau, pade_order):
-        return tf([1], [Tau, 1, 0]) * pade_index[int(pade_order)](1)
+        return tf([1], [Tau, 1, 0]) * delay.approximant(pade_order, 1)
+    
+    def coefficients(self, Tau, pade_order):
+        pade_num, pade_den = pade(pade_order, 1)
+        return pade_num, polymul([Tau, 1, 0], pade_den)
+    
+    def zpk(self, Tau, pade_order):
+        zeros, poles, gain = delay.pade_zpk(pade_order, 1)
+        return zeros, [0.0, -1.0 / Tau] + poles, gain / (1.0 * Tau)
+    
+    def dead_time(self, Tau, pade_order):
+        return 1
 
 index = {
     1: Model1,
@@ -333,3 +589,23 @@ index = {
     13: Model13,
     14: Model14,
 }
+
+_catalogs = {}
+
+def catalog(locale):
+    """Returns a dict mapping the model ids of ``index`` to dicts with the
+    ``name``, ``description`` and ``transfer_function`` (LaTeX) of each
+    model, for ``locale``. The result is built once per locale and shared,
+    so it must not be changed.
+    """
+    result = _catalogs.get(locale)
+    if result is None:
+        result = {}
+        for model_id, model in index.items():
+            result[model_id] = {
+                'name': model.name(locale),
+                'description': model.description(locale),
+                'transfer_function': model.transfer_function,
+            }
+        _catalogs[locale] = result
+    return result
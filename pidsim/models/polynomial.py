@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.polynomial
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Plain coefficient-list polynomial helpers.
+
+    Polynomials are lists of coefficients, highest power first, like the
+    ones accepted by ``pidsim.core.types.tf``. The helpers only use the
+    ``+``, ``-`` and ``*`` operators on the coefficients, so they work both
+    with plain numbers and with NumPy arrays (one polynomial per element).
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['polymul', 'polyadd', 'binomial', 'pade']
+
+from math import factorial
+
+
+def polymul(*polys):
+    """Returns the product of the given polynomials."""
+    result = [1]
+    for p in polys:
+        out = [0] * (len(result) + len(p) - 1)
+        for i, a in enumerate(result):
+            for j, b in enumerate(p):
+                out[i + j] = out[i + j] + a * b
+        result = out
+    return result
+
+
+def polyadd(a, b):
+    """Returns the sum of two polynomials."""
+    size = max(len(a), len(b))
+    a = [0] * (size - len(a)) + list(a)
+    b = [0] * (size - len(b)) + list(b)
+    return [i + j for i, j in zip(a, b)]
+
+
+def binomial(n, tau=None):
+    """Returns the coefficients of ``(tau s + 1)^n``, or ``(s + 1)^n`` if
+    ``tau`` isn't given.
+
+    The binomial coefficients are generated directly, with exact integer
+    arithmetic, instead of multiplying ``n`` first order polynomials.
+    """
+    coefs = [1]
+    for k in range(n):
+        coefs.append(coefs[-1] * (n - k) // (k + 1))
+    if tau is None:
+        return coefs[::-1]
+    return [c * tau ** k for k, c in reversed(list(enumerate(coefs)))]
+
+
+def pade(order, Tt):
+    """Returns the numerator and denominator of the diagonal Padé
+    approximant of ``e^{-Tt s}``.
+    """
+    order = int(order)
+    num = []
+    den = []
+    for k in range(order, -1, -1):
+        c = float(factorial(2 * order - k) * factorial(order)) / \
+            (factorial(2 * order) * factorial(k) * factorial(order - k))
+        num.append(c * (-Tt) ** k)
+        den.append(c * Tt ** k)
+    return num, den
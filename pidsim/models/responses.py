@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.responses
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Two-tier cache of simulated responses. Requires NumPy.
+
+    The responses are looked up first in an in-process
+    :class:`pidsim.models.cache.LRUCache`, and then in an optional SQLite
+    database, shared by all the processes that open the same file. The
+    database is bounded in size, evicting the least recently used entries,
+    and survives restarts, so a new worker starts with every response the
+    previous ones computed.
+
+    The keys include the model id, the parameters, the simulation settings
+    and the package version, so upgrading the package never returns stale
+    responses.
+
+    The responses are stored in the NumPy ``.npz`` format, loaded without
+    pickle support, so a database shared with other processes can't make
+    this one run code. Only arrays, and tuples of arrays, can be cached.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['ResponseCache']
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import numpy
+
+from pidsim.models import __version__
+from pidsim.models.cache import LRUCache
+from pidsim.models.simulation import build_model, step_responses
+
+_missing = object()
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+'''
+
+
+class ResponseCache(object):
+    """Cache of step and frequency responses.
+
+    ``memory_size`` is the number of responses kept in the process, and
+    ``path`` the SQLite database file of the persistent tier (None to keep
+    the responses in memory only), bounded to ``disk_size`` bytes of
+    responses.
+    """
+
+    def __init__(self, path=None, memory_size=128, disk_size=256 << 20,
+                 timeout=30):
+        self.path = path
+        self.disk_size = disk_size
+        self.timeout = timeout
+        self.memory = LRUCache(memory_size, name='responses')
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # sqlite connections must not cross a fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         check_same_thread=False,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def key(kind, model_id, params, **settings):
+        """Returns the key of a response: a digest of its kind, the model
+        id, the parameters (normalized like the callback cache keys), the
+        settings and the package version.
+        """
+        model, args, kwargs = build_model(model_id, params)
+        values = model._cache_key(args, kwargs)
+        if values is None:
+            raise TypeError('The parameters must give a value for every '
+                            'argument: %s' % ', '.join(model.args))
+        settings = tuple(sorted((name, _normalize(value)) \
+                                for name, value in settings.items()))
+        description = repr((kind, int(model_id), values, settings,
+                            __version__))
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _missing)
+        if value is not _missing:
+            return value
+        if self.path is None:
+            return default
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT value FROM responses WHERE '
+                                     'key = ?', (key,)).fetchone()
+            value = _missing if row is None else _loads(row[0])
+            if value is _missing:
+                self.disk_misses += 1
+                return default
+            self.disk_hits += 1
+            connection.execute('UPDATE responses SET accessed = ? WHERE '
+                               'key = ?', (time.time(), key))
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        value = _readonly(value)
+        self.memory.set(key, value)
+        if self.path is None:
+            return
+        blob = _dumps(value)
+        with self._lock:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO responses (key, '
+                               'value, size, accessed) VALUES (?, ?, ?, ?)',
+                               (key, sqlite3.Binary(blob), len(blob),
+                                time.time()))
+            self._evict(connection)
+
+    def _evict(self, connection):
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM '
+                                   'responses').fetchone()[0]
+        if total <= self.disk_size:
+            return
+        keys = []
+        for key, size in connection.execute('SELECT key, size FROM '
+                                            'responses ORDER BY accessed'):
+            keys.append((key,))
+            total -= size
+            if total <= self.disk_size:
+                break
+        connection.executemany('DELETE FROM responses WHERE key = ?', keys)
+
+    def cached(self, key, builder):
+        """Returns the response of ``key``, computing it with ``builder()``
+        and storing it if it isn't in any tier. The response must be an
+        array or a tuple of arrays."""
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = builder()
+            self.set(key, value)
+        return value
+
+    def step_response(self, model_id, params, t_final, samples=1000):
+        """Returns the (t, y) unit step response of the system, as
+        :func:`pidsim.models.simulation.step_responses` would, but cached.
+        """
+        key = self.key('step', model_id, params, t_final=t_final,
+                       samples=samples)
+
+        def build():
+            t, y = step_responses([(model_id, params)], t_final, samples)
+            return t, y[0]
+
+        return self.cached(key, build)
+
+    def frequency_response(self, model_id, omega, exact_delay=False,
+                           form='tf', **params):
+        """Returns the (magnitude, phase) frequency response of the model,
+        for one parameter set given as keywords, as
+        :meth:`ReferenceModel.frequency_response` would, but cached.
+        """
+        omega = numpy.asarray(omega, dtype=float)
+        key = self.key('frequency', model_id, params,
+                       omega=hashlib.sha1(omega.tobytes()).hexdigest(),
+                       exact_delay=bool(exact_delay), form=form)
+        model = build_model(model_id, params)[0]
+        return self.cached(key, lambda: model.frequency_response(
+            omega, exact_delay=exact_delay, form=form, **params))
+
+    def preload(self):
+        """Fills the in-process tier with the most recently used responses
+        of the database, e.g. when a worker starts. Returns how many were
+        loaded."""
+        if self.path is None or self.memory.maxsize <= 0:
+            return 0
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT key, value FROM responses ORDER BY accessed DESC '
+                'LIMIT ?', (self.memory.maxsize,)).fetchall()
+        # the least recently used go in first, to be evicted first
+        loaded = 0
+        for key, blob in reversed(rows):
+            value = _loads(blob)
+            if value is not _missing:
+                self.memory.set(key, value)
+                loaded += 1
+        return loaded
+
+    def clear(self):
+        """Empties both tiers."""
+        self.memory.clear()
+        if self.path is not None:
+            with self._lock:
+                self._connect().execute('DELETE FROM responses')
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.path is not None:
+            with self._lock:
+                count, size = self._connect().execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM '
+                    'responses').fetchone()
+            stats['disk'] = {
+                'hits': self.disk_hits,
+                'misses': self.disk_misses,
+                'size': count,
+                'bytes': size,
+                'maxbytes': self.disk_size,
+            }
+        return stats
+
+
+def _normalize(value):
+    if isinstance(value, (bool, str)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def _dumps(value):
+    # an array is stored as 'array', a tuple of arrays as 'item0', ...
+    if isinstance(value, (tuple, list)):
+        arrays = dict(('item%d' % i, numpy.asarray(item)) \
+                      for i, item in enumerate(value))
+    else:
+        arrays = {'array': numpy.asarray(value)}
+    for array in arrays.values():
+        if array.dtype.hasobject:
+            raise TypeError('Only numeric arrays can be cached.')
+    buffer = io.BytesIO()
+    numpy.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _loads(blob):
+    # the value stored by _dumps, read-only, or _missing if the blob isn't
+    # in that format (e.g. written by an older version)
+    try:
+        with numpy.load(io.BytesIO(bytes(blob)), allow_pickle=False) as data:
+            if 'array' in data.files:
+                value = data['array']
+            else:
+                value = tuple(data['item%d' % i] \
+                              for i in range(len(data.files)))
+    except (ValueError, OSError, KeyError):
+        return _missing
+    return _readonly(value)
+
+
+def _readonly(value):
+    # the cached arrays are shared by every caller
+    if isinstance(value, numpy.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _readonly(item)
+    return value
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.simulation
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Batched time-domain simulation of the reference models. Requires NumPy.
+
+    The systems are given as ``(model id, params)`` pairs, where the model id
+    is a key of :data:`pidsim.models.models.index` and params is either a
+    sequence of positional arguments or a dict of keyword arguments to the
+    model callback.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['build_model', 'discretize', 'step_responses']
+
+import numpy
+
+from pidsim.models.models import index
+
+
+def build_model(model_id, params):
+    """Returns the model instance and the (args, kwargs) to call it with."""
+    model = index[model_id](None)
+    if isinstance(params, dict):
+        return model, (), params
+    return model, tuple(params), {}
+
+
+def discretize(systems, Ts):
+    """Discretizes the systems with a zero-order hold and stacks their
+    matrices, padded with decoupled zero states to a common order.
+
+    Returns the (Ad, Bd, C, D) arrays, with shapes (k, n, n), (k, n),
+    (k, n) and (k,), for k systems of maximum order n.
+    """
+    compiled = []
+    for model_id, params in systems:
+        model, args, kwargs = build_model(model_id, params)
+        compiled.append(model.compile(Ts, *args, **kwargs))
+    count = len(compiled)
+    order = max([system.order for system in compiled] + [0])
+    Ad = numpy.zeros((count, order, order))
+    Bd = numpy.zeros((count, order))
+    C = numpy.zeros((count, order))
+    D = numpy.zeros(count)
+    for i, system in enumerate(compiled):
+        n = system.order
+        Ad[i, :n, :n] = system.A
+        Bd[i, :n] = system.B[:, 0]
+        C[i, :n] = system.C[0, :]
+        D[i] = system.D[0, 0]
+    return Ad, Bd, C, D
+
+
+def _step_responses(systems, Ts, samples):
+    Ad, Bd, C, D = discretize(systems, Ts)
+    out = numpy.empty((len(D), samples))
+    x = numpy.zeros(Bd.shape)
+    ax = numpy.empty(Bd.shape)
+    for i in range(samples):
+        # unit step input: y = C x + D, x = Ad x + Bd
+        numpy.einsum('kn,kn->k', C, x, out=out[:, i])
+        out[:, i] += D
+        numpy.einsum('kmn,kn->km', Ad, x, out=ax)
+        numpy.add(ax, Bd, out=x)
+    return out
+
+
+def step_responses(systems, t_final, samples=1000, workers=None):
+    """Simulates the unit step response of all the systems together.
+
+    Returns the time vector and a 2-D array with one response per row.
+    If ``workers`` is given, the systems are split in chunks of similar
+    order, simulated by a ``concurrent.futures.ProcessPoolExecutor`` with
+    that many processes.
+    """
+    systems = list(systems)
+    Ts = float(t_final) / (samples - 1)
+    t = numpy.arange(samples) * Ts
+    if not workers or len(systems) < 2:
+        return t, _step_responses(systems, Ts, samples)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # systems of similar order go to the same chunk, so less padding is
+    # wasted in each batch.
+    orders = []
+    for position, (model_id, params) in enumerate(systems):
+        model, args, kwargs = build_model(model_id, params)
+        den = model.coefficients(*args, **kwargs)[1]
+        orders.append((len(den), position))
+    orders.sort()
+    chunk_size = -(-len(systems) // workers)
+    chunks = [[position for order, position in orders[i:i + chunk_size]]
+              for i in range(0, len(orders), chunk_size)]
+    out = numpy.empty((len(systems), samples))
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(_step_responses,
+                                   [systems[i] for i in chunk], Ts, samples)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            out[chunk] = future.result()
+    finally:
+        executor.shutdown()
+    return t, out
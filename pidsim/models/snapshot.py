@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.snapshot
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Binary snapshots of evaluated models, to share precomputed transfer
+    functions between processes without unpickling them. Requires NumPy.
+
+    A snapshot file has three parts, all little-endian:
+
+    - a 64 bytes header (:data:`HEADER`), with the magic string, the format
+      version, the record count and the record layout;
+    - the records, one per evaluated parameter set, of float64 values only:
+      the model id, the parameters (padded with zeros to the longest
+      argument list of the file) and the numerator and denominator
+      coefficients (padded with leading zeros to the highest degree of the
+      file);
+    - the index, an int64 array with the record numbers sorted by model id
+      and parameters, for binary search.
+
+    The records and the index are mapped with ``numpy.memmap``, so opening
+    a snapshot costs the same for any size, and the pages are shared by
+    all the processes that map the same file::
+
+        snapshot.write('model4.snap', [(4, {'k': k, 'T1': T1, ...})])
+        snap = snapshot.Snapshot('model4.snap')
+        num, den = snap.coefficients(4, 1, 1, 2, 3, 0.5, 1, 2)
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['MAGIC', 'VERSION', 'HEADER', 'record_dtype', 'write',
+           'Snapshot']
+
+import numpy
+
+from pidsim.models.models import index, tf
+
+MAGIC = b'PIDSIMSS'
+VERSION = 1
+
+HEADER = numpy.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('params', '<u4'),
+    ('coefs', '<u4'),
+    ('reserved', '<u4'),
+    ('count', '<u8'),
+    ('records', '<u8'),
+    ('index', '<u8'),
+    ('padding', 'V16'),
+])
+
+
+def record_dtype(params, coefs):
+    """Returns the dtype of the records with room for ``params``
+    parameters and ``coefs`` coefficients per polynomial.
+    """
+    return numpy.dtype([
+        ('model', '<f8'),
+        ('params', '<f8', (params,)),
+        ('num', '<f8', (coefs,)),
+        ('den', '<f8', (coefs,)),
+    ])
+
+
+def write(path, batches):
+    """Evaluates the batches of parameter sets and writes them to a
+    snapshot at ``path``. ``batches`` is an iterable of ``(model id,
+    arrays)`` pairs, where arrays is a dict with an array for each callback
+    argument, as in :meth:`ReferenceModel.callback_batch`. Returns the
+    number of records written.
+    """
+    evaluated = []
+    for model_id, arrays in batches:
+        model = index[model_id](None)
+        num, den = model.callback_batch(**arrays)
+        columns, size = model._columns(arrays)
+        params = numpy.column_stack(columns) if columns else \
+            numpy.zeros((size, 0))
+        evaluated.append((model_id, params, num, den))
+    params_width = max([params.shape[1] for model_id, params, num, den \
+                        in evaluated] + [0])
+    coefs_width = max([max(num.shape[1], den.shape[1]) for model_id, params,
+                       num, den in evaluated] + [1])
+    records = numpy.zeros(sum(len(params) for model_id, params, num, den \
+                              in evaluated),
+                          dtype=record_dtype(params_width, coefs_width))
+    start = 0
+    for model_id, params, num, den in evaluated:
+        rows = slice(start, start + len(params))
+        records['model'][rows] = model_id
+        records['params'][rows, :params.shape[1]] = params
+        records['num'][rows, coefs_width - num.shape[1]:] = num
+        records['den'][rows, coefs_width - den.shape[1]:] = den
+        start += len(params)
+
+    # numpy.lexsort sorts by the last key first
+    keys = [records['params'][:, i] for i in range(params_width - 1, -1, -1)]
+    order = numpy.lexsort(keys + [records['model']]).astype('<i8')
+
+    header = numpy.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['params'] = params_width
+    header['coefs'] = coefs_width
+    header['count'] = len(records)
+    header['records'] = HEADER.itemsize
+    header['index'] = HEADER.itemsize + records.nbytes
+    with open(path, 'wb') as fp:
+        fp.write(header.tobytes())
+        fp.write(records.tobytes())
+        fp.write(order.tobytes())
+    return len(records)
+
+
+class Snapshot(object):
+    """Read-only, memory-mapped snapshot file."""
+    
+    def __init__(self, path):
+        header = numpy.fromfile(path, dtype=HEADER, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC:
+            raise ValueError('Not a snapshot file: %s' % path)
+        header = header[0]
+        if header['version'] != VERSION:
+            raise ValueError('Unsupported snapshot version: %d' % \
+                header['version'])
+        self.path = path
+        count = int(header['count'])
+        self.dtype = record_dtype(int(header['params']), int(header['coefs']))
+        if count:
+            self.records = numpy.memmap(path, dtype=self.dtype, mode='r',
+                                        offset=int(header['records']),
+                                        shape=(count,))
+            self.index = numpy.memmap(path, dtype='<i8', mode='r',
+                                      offset=int(header['index']),
+                                      shape=(count,))
+        else:
+            self.records = numpy.zeros(0, dtype=self.dtype)
+            self.index = numpy.zeros(0, dtype='<i8')
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def _key(self, row):
+        record = self.records[row]
+        return (record['model'],) + tuple(record['params'])
+    
+    def find(self, model_id, *args, **kwargs):
+        """Returns the record number of the parameter set, or -1 if it
+        isn't in the snapshot."""
+        signature = index[model_id].signature()
+        values = list(args) + [kwargs.get(arg, signature.defaults.get(arg)) \
+                               for arg in signature.args[len(args):]]
+        width = self.dtype['params'].shape[0]
+        if len(values) > width:
+            return -1
+        key = tuple([float(model_id)] + [float(value) for value in values] +
+                    [0.0] * (width - len(values)))
+        low, high = 0, len(self.index)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(self.index[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.index):
+            row = int(self.index[low])
+            if self._key(row) == key:
+                return row
+        return -1
+    
+    def coefficients(self, model_id, *args, **kwargs):
+        """Returns the numerator and the denominator coefficients of the
+        parameter set, without the padding, as read-only arrays. Raises
+        ``KeyError`` if it isn't in the snapshot.
+        """
+        row = self.find(model_id, *args, **kwargs)
+        if row < 0:
+            raise KeyError((model_id, args, kwargs))
+        record = self.records[row]
+        return _trim(record['num']), _trim(record['den'])
+    
+    def callback(self, model_id, *args, **kwargs):
+        """Returns the transfer function of the parameter set, like the
+        model callback would, from the stored coefficients."""
+        num, den = self.coefficients(model_id, *args, **kwargs)
+        return tf(num.tolist(), den.tolist())
+
+
+def _trim(coefs):
+    nonzero = numpy.flatnonzero(coefs)
+    return coefs[nonzero[0]:] if len(nonzero) else coefs[-1:]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    pidsim.models.streaming
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Streaming simulation of the reference models, for long-horizon and
+    hardware-in-the-loop runs. Requires NumPy.
+
+    A :class:`Stream` holds the zero-order hold discretization of one model
+    and its state, and advances it by chunks of input samples, so the memory
+    use doesn't depend on the length of the run::
+
+        stream = Stream(index[14](None), 0.001, Tau=2, pade_order=3)
+        for y in stream.run(inputs):
+            ...
+
+    For asyncio, see :mod:`pidsim.models.aio`.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+__all__ = ['Stream']
+
+import numpy
+
+
+class Stream(object):
+    """Streaming simulator of ``model``, with sample time ``Ts``, for the
+    parameters given as keywords.
+
+    With ``exact_delay``, the dead time of the model is simulated as a
+    delay line of ``round(dead_time / Ts)`` samples, instead of with the
+    Padé approximant. The ``form`` keyword is passed to
+    :meth:`ReferenceModel.compile`.
+    """
+    
+    def __init__(self, model, Ts, exact_delay=False, form='tf', **params):
+        self.model = model
+        self.Ts = float(Ts)
+        self.params = params
+        self.exact_delay = bool(exact_delay)
+        self.form = form
+        delay = 0
+        if exact_delay:
+            params, dead_time = model._without_dead_time(params)
+            delay = int(round(float(dead_time) / self.Ts))
+        self.system = model.compile(self.Ts, form=form, **params)
+        self.samples = 0
+        self._line = numpy.zeros(delay)
+    
+    @property
+    def time(self):
+        """Time of the next sample."""
+        return self.samples * self.Ts
+    
+    def reset(self):
+        """Returns to the zero state, at time zero."""
+        self.system.reset()
+        self._line.fill(0.0)
+        self.samples = 0
+    
+    def feed(self, u):
+        """Advances the simulation by the input samples ``u``, a scalar or
+        a 1-D array, and returns the outputs in the same shape.
+        """
+        scalar = numpy.ndim(u) == 0
+        u = numpy.ascontiguousarray(u, dtype=float).ravel()
+        size = len(self._line)
+        if size:
+            line = numpy.concatenate((self._line, u))
+            u = line[:len(u)]
+            self._line = line[len(u):]
+        y = self.system.simulate(u)
+        self.samples += len(u)
+        return float(y[0]) if scalar else y
+    
+    def run(self, inputs):
+        """Generator that feeds every item of the iterable ``inputs`` (of
+        scalars or of 1-D arrays of samples) and yields its outputs, as
+        soon as they are computed.
+        """
+        for u in inputs:
+            yield self.feed(u)
+    
+    def checkpoint(self):
+        """Returns the state of the simulation as a dict of plain Python
+        values, that can be pickled or dumped to JSON and given to
+        :meth:`restore`.
+        """
+        return {
+            'model': type(self.model).__name__,
+            'params': self._plain_params(),
+            'exact_delay': self.exact_delay,
+            'form': self.form,
+            'Ts': self.Ts,
+            'samples': self.samples,
+            'state': [float(value) for value in self.system.x],
+            'delay_line': [float(value) for value in self._line],
+        }
+    
+    def restore(self, checkpoint):
+        """Restores the state saved by :meth:`checkpoint`, from a stream of
+        the same model, parameters, options and sample time.
+        """
+        if checkpoint['model'] != type(self.model).__name__ or \
+           checkpoint.get('params') != self._plain_params() or \
+           checkpoint.get('exact_delay') != self.exact_delay or \
+           checkpoint.get('form') != self.form or \
+           checkpoint['Ts'] != self.Ts or \
+           len(checkpoint['state']) != self.system.order or \
+           len(checkpoint['delay_line']) != len(self._line):
+            raise ValueError('The checkpoint is from a different stream.')
+        self.system.x[:] = checkpoint['state']
+        self._line[:] = checkpoint['delay_line']
+        self.samples = int(checkpoint['samples'])
+    
+    def _plain_params(self):
+        # the parameters as plain Python values, also for NumPy scalars
+        return dict((name, value.item() if hasattr(value, 'item') else value)
+                    for name, value in self.params.items())
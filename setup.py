@@ -37,4 +37,7 @@ setup(
     install_requires = [
         'pidsim>=1.0rc6',
     ],
+    extras_require = {
+        'numpy': ['numpy'],
+    },
 )
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of the interned Padé approximants.
+
+    Run with ``python -m unittest discover tests``. Needs pidsim.core.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import unittest
+
+from pidsim.models import delay
+from pidsim.models.models import index
+
+
+class ApproximantTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # the callback caches would hide the approximant lookups
+        for model_class in index.values():
+            model_class.cache_clear()
+        delay.clear()
+
+    def tearDown(self):
+        delay.clear()
+
+    def test_shared_by_the_callbacks(self):
+        # each Tau is a callback cache miss, that reuses the unit delay
+        for i in range(100):
+            Tau = 1 + i / 100.0
+            index[8].for_locale(None).callback(Tau, 2)
+            index[9].for_locale(None).callback(Tau, 2)
+            index[14].for_locale(None).callback(Tau, 2)
+        stats = delay.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 299)
+        self.assertTrue(stats['hit_rate'] > 0.99)
+
+    def test_keyed_by_dead_time(self):
+        model = index[4].for_locale(None)
+        for Tt in (0.5, 1.0, 0.5, 1.0):
+            model.callback(1, 1, 2, 3, 0.5, Tt, 3)
+        self.assertEqual(delay.stats()['misses'], 2)
+
+    def test_unknown_order(self):
+        # no closed form fallback: the orders are the ones of pidsim.core
+        self.assertRaises(KeyError, index[8].for_locale(None).callback, 2,
+                          max(delay.orders()) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of the fitting of the reference models to step responses.
+
+    Run with ``python -m unittest discover tests``. Needs pidsim.core and
+    NumPy.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import unittest
+
+import numpy
+
+from pidsim.models.fitting import fit_catalog, fit_model
+from pidsim.models.models import index
+
+T = numpy.linspace(0, 20, 200)
+
+
+class FitModelTestCase(unittest.TestCase):
+
+    def test_integer_argument_only(self):
+        # Model5 has no continuous argument: every n must be tried
+        for n in (2, 4):
+            y = index[5](None).analytic_step(T, n)
+            result = fit_model(5, T, y)
+            self.assertEqual(result.params, {'n': n})
+            self.assertTrue(result.rms < 1e-6)
+
+    def test_continuous_arguments(self):
+        y = index[2](None).analytic_step(T, 2.0, 1.5, 3.0)
+        result = fit_model(2, T, y)
+        self.assertTrue(result.rms < 1e-6)
+        self.assertAlmostEqual(result.params['k'], 2.0, places=4)
+        self.assertAlmostEqual(sorted([result.params['T1'],
+                                       result.params['T2']])[0], 1.5,
+                               places=3)
+
+
+class FitCatalogTestCase(unittest.TestCase):
+
+    def test_ranking(self):
+        y = index[1](None).analytic_step(T, 1.0, 2.0)
+        results = list(fit_catalog(T, y, model_ids=[5, 1]))
+        self.assertEqual([result.model_id for result, ranking in results],
+                         [5, 1])
+        ranking = results[-1][1]
+        self.assertEqual(ranking[0].model_id, 1)
+        self.assertTrue(ranking[0].residual <= ranking[1].residual)
+
+    def test_close_early(self):
+        y = index[1](None).analytic_step(T, 1.0, 2.0)
+        results = fit_catalog(T, y, model_ids=[1, 2, 5, 6], workers=1)
+        result, ranking = next(results)
+        self.assertEqual(ranking, [result])
+        results.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+    Behavior tests of the reference models: the factored and the expanded
+    forms, the closed-form step responses, the discretizations and the
+    metrics must agree with each other.
+
+    Run with ``python -m unittest discover tests``. Needs pidsim.core and
+    NumPy.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import unittest
+
+import numpy
+
+from pidsim.models.benchmark import PARAMETER_SETS
+from pidsim.models.lti import zpk_response
+from pidsim.models.models import index
+
+# away from the poles on the imaginary axis (Model11 and Model14 have one
+# at the origin)
+OMEGA = numpy.array([0.05, 0.3, 1.0, 2.5, 10.0])
+
+METRICS = ('dc_gain', 'time_constant', 'stable', 'integrating', 'unstable',
+           'minimum_phase')
+
+
+def difference_equation_output(b, a, u):
+    # runs a[0] y[k] + a[1] y[k-1] + ... = b[0] u[k] + b[1] u[k-1] + ...
+    y = numpy.zeros(len(u))
+    for k in range(len(u)):
+        total = sum(b[i] * u[k - i] for i in range(len(b)) if k - i >= 0)
+        total -= sum(a[i] * y[k - i] for i in range(1, len(a)) if k - i >= 0)
+        y[k] = total / a[0]
+    return y
+
+
+def parameter_sets():
+    # (model, params) for all the parameter sets of the benchmarks
+    for model_id, sets in sorted(PARAMETER_SETS.items()):
+        model = index[model_id](None)
+        for params in sets:
+            yield model, params
+
+
+class FormsTestCase(unittest.TestCase):
+
+    def test_zpk_matches_coefficients(self):
+        s = 1j * OMEGA
+        for model, params in parameter_sets():
+            num, den = model.coefficients(*params)
+            expected = numpy.polyval(num, s) / numpy.polyval(den, s)
+            response = zpk_response(*model.zpk(*params) + (s,))
+            self.assertTrue(numpy.allclose(response, expected, rtol=1e-8,
+                                           atol=1e-12),
+                            '%s%r' % (type(model).__name__, params))
+
+    def test_callback_matches_coefficients(self):
+        for model, params in parameter_sets():
+            value = model.callback(*params)
+            num, den = model.coefficients(*params)
+            self.assertTrue(numpy.allclose([float(c) for c in value.num],
+                                           num))
+            self.assertTrue(numpy.allclose([float(c) for c in value.den],
+                                           den))
+
+    def test_frequency_response_forms(self):
+        for model, params in parameter_sets():
+            params = dict(zip(model.args, params))
+            magnitude, phase = model.frequency_response(OMEGA, **params)
+            zpk_magnitude, zpk_phase = model.frequency_response(
+                OMEGA, form='zpk', **params)
+            self.assertTrue(numpy.allclose(magnitude, zpk_magnitude,
+                                           rtol=1e-8),
+                            '%s%r' % (type(model).__name__, params))
+
+
+class StepTestCase(unittest.TestCase):
+
+    def test_step_formula_matches_simulation(self):
+        # the zero-order hold discretization is exact for a step input
+        Ts = 0.05
+        samples = 100
+        t = Ts * numpy.arange(samples)
+        checked = 0
+        for model, params in parameter_sets():
+            y = model.step_formula(t, *params)
+            if y is None:
+                continue
+            simulated = model.compile(Ts, *params).step_response(samples)
+            self.assertTrue(numpy.allclose(y, simulated, rtol=1e-6,
+                                           atol=1e-9),
+                            '%s%r' % (type(model).__name__, params))
+            checked += 1
+        self.assertTrue(checked >= 5)
+
+    def test_discretize_exact_delay(self):
+        # Model8 is Model1, with k = 1, delayed by 1 s
+        Ts = 0.1
+        samples = 80
+        u = numpy.ones(samples)
+        shift = int(round(1 / Ts))
+        for Tau in (0.5, 2):
+            b, a = index[8](None).discretize(Ts, exact_delay=True, Tau=Tau,
+                                             pade_order=2)
+            y = difference_equation_output(b, a, u)
+            expected = numpy.zeros(samples)
+            expected[shift:] = index[1](None).compile(Ts, 1, Tau) \
+                .step_response(samples - shift)
+            self.assertTrue(numpy.allclose(y, expected, atol=1e-9))
+
+    def test_discretize_matches_compile(self):
+        Ts = 0.1
+        samples = 60
+        u = numpy.ones(samples)
+        for model, params in parameter_sets():
+            b, a = model.discretize(Ts, **dict(zip(model.args, params)))
+            y = difference_equation_output(b, a, u)
+            simulated = model.compile(Ts, *params).step_response(samples)
+            self.assertTrue(numpy.allclose(y, simulated, rtol=1e-6,
+                                           atol=1e-6),
+                            '%s%r' % (type(model).__name__, params))
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_metrics_batch_matches_metrics(self):
+        for model_id, sets in sorted(PARAMETER_SETS.items()):
+            model = index[model_id](None)
+            arrays = dict((arg, numpy.array(column)) \
+                for arg, column in zip(model.args, zip(*sets)))
+            batch = model.metrics_batch(**arrays)
+            for row, params in enumerate(sets):
+                metrics = model.metrics(*params)
+                for name in METRICS:
+                    expected = getattr(metrics, name)
+                    if expected is None:
+                        expected = numpy.nan
+                    self.assertTrue(numpy.allclose(batch[name][row],
+                                                   expected, equal_nan=True),
+                                    'Model%d%r: %s' % (model_id, params,
+                                                       name))
+
+    def test_dead_time_is_not_minimum_phase(self):
+        self.assertFalse(index[8](None).metrics(1, 2).minimum_phase)
+        self.assertTrue(index[1](None).metrics(1, 2).minimum_phase)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+    Multi-threaded stress tests of the shared model instances and caches.
+
+    Run with ``python -m unittest discover tests``. Needs pidsim.core.
+
+    :copyright: 2010 by Rafael Goncalves Martins
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import random
+import threading
+import unittest
+
+from pidsim.models.benchmark import PARAMETER_SETS
+from pidsim.models.cache import LRUCache, StripedLRUCache
+from pidsim.models.models import index
+
+THREADS = 8
+ITERATIONS = 1000
+LOCALES = ('en_US', 'pt_BR', None)
+
+# the class attributes changed by SharedModelsTestCase
+SAVED = ('callback_cache_size', 'cache_size', '_caches')
+
+_missing = object()
+
+
+def coefficients(value):
+    # the coefficients of a tf, as floats
+    return [float(coef) for coef in value.num], \
+        [float(coef) for coef in value.den]
+
+
+def run_threads(count, target):
+    # runs target(i) in count threads, released together, and returns the
+    # exceptions they raised
+    start = threading.Event()
+    errors = []
+
+    def run(i):
+        start.wait()
+        try:
+            target(i)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class SharedModelsTestCase(unittest.TestCase):
+    """Calls ``callback``, ``coefficients`` and ``get`` of the shared model
+    instances from many threads at once, with random parameter sets and
+    locales, and checks every result against the one computed by a single
+    thread. The model caches are shrunk to a few entries, so the threads
+    also race on the evictions.
+    """
+
+    def setUp(self):
+        # save exactly what is changed: the cache size attributes of each
+        # class dict (if any) and its caches dict
+        self.saved = []
+        for model_class in index.values():
+            for name in SAVED:
+                self.saved.append((model_class, name,
+                                   model_class.__dict__.get(name, _missing)))
+            model_class.callback_cache_size = 2
+            model_class.cache_size = 2
+            model_class._caches = {}
+
+    def tearDown(self):
+        for model_class, name, value in self.saved:
+            if value is _missing:
+                delattr(model_class, name)
+            else:
+                setattr(model_class, name, value)
+
+    def test_concurrent_calls(self):
+        work = []
+        for model_id, parameter_sets in sorted(PARAMETER_SETS.items()):
+            model = index[model_id].for_locale(None)
+            for params in parameter_sets:
+                work.append((model, params, coefficients(model.callback(*params)),
+                             model.coefficients(*params),
+                             [model.get('name', locale) \
+                              for locale in LOCALES]))
+        failures = []
+
+        def target(i):
+            rng = random.Random(i)
+            for j in range(ITERATIONS):
+                model, params, expected, coefs, names = rng.choice(work)
+                position = rng.randrange(len(LOCALES))
+                if coefficients(model.callback(*params)) != expected:
+                    failures.append((type(model).__name__, params,
+                                     'callback'))
+                if model.coefficients(*params) != coefs:
+                    failures.append((type(model).__name__, params,
+                                     'coefficients'))
+                if model.get('name', LOCALES[position]) != names[position]:
+                    failures.append((type(model).__name__, params, 'get'))
+
+        self.assertEqual(run_threads(THREADS, target), [])
+        self.assertEqual(failures, [])
+        for model_class in index.values():
+            stats = model_class.cache_info()
+            self.assertTrue(stats['size'] <= stats['maxsize'])
+
+    def test_shared_instances(self):
+        instances = []
+
+        def target(i):
+            for model_class in index.values():
+                instances.append(model_class.for_locale('en_US'))
+
+        self.assertEqual(run_threads(THREADS, target), [])
+        for model_class in index.values():
+            shared = [instance for instance in instances \
+                      if type(instance) is model_class]
+            self.assertEqual(len(set(map(id, shared))), 1)
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def check(self, cache):
+        def target(i):
+            rng = random.Random(i)
+            for j in range(ITERATIONS):
+                key = rng.randrange(64)
+                value = cache.get(key)
+                if value is None:
+                    cache.set(key, key * 2)
+                elif value != key * 2:
+                    raise AssertionError('%r: %r' % (key, value))
+
+        self.assertEqual(run_threads(THREADS, target), [])
+        stats = cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'],
+                         THREADS * ITERATIONS)
+        self.assertTrue(len(cache) <= cache.maxsize)
+
+    def test_lru_cache(self):
+        self.check(LRUCache(16))
+
+    def test_striped_lru_cache(self):
+        self.check(StripedLRUCache(16, stripes=4))
+
+    def test_striped_lru_cache_uneven(self):
+        # maxsize not a multiple of the stripes
+        for maxsize in (1, 3, 10, 13):
+            cache = StripedLRUCache(maxsize, stripes=8)
+            self.check(cache)
+            for key in range(1000):
+                cache.set(key, key * 2)
+            self.assertEqual(len(cache), maxsize)
+            self.assertEqual(cache.stats()['size'], maxsize)
+
+
+if __name__ == '__main__':
+    unittest.main()